@@ -49,3 +49,4 @@ class Model(BaseModel):
     session: Session
     settings: Settings
     messages: List[Message]
+    summary: str = ''
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Union
+from typing import Dict, Union
 
 from data.conversation import *
 from utils.file_io import load_yaml
@@ -9,4 +9,24 @@ PathLike = Union[str, Path]
 
 def parse(data_path: PathLike) -> Model:
     data = load_yaml(data_path)
+    return parse_data(data)
+
+
+def parse_data(data: Dict) -> Model:
     return Model.parse_obj(data)
+
+
+def construct(data: Dict) -> Model:
+    """Build a model from trusted data, skipping validation."""
+    settings = data['settings']
+
+    return Model.construct(
+        session=Session.construct(**data['session']),
+        settings=Settings.construct(**{
+            **settings,
+            'participants': [Participant.construct(**participant) for participant in settings['participants']],
+            'traits': [Trait.construct(**trait) for trait in settings['traits']],
+        }),
+        messages=[Message.construct(**message) for message in data['messages']],
+        summary=data.get('summary', ''),
+    )
@@ -1,9 +1,14 @@
-from typing import Optional, Iterator, Iterable, List
+import bisect
+from typing import Optional, Iterator, List, Tuple, Hashable, Sequence, Dict, Iterable
 
 from data import prompt, conversation
 from data.conversation import Trait as UserTrait, Message
-from data.prompt import Trait, Choice
+from data.persona import PersonaTemplates, Template
+from data.prompt import Trait
 from utils.iteration import trim
+from utils.pagination import ChainedLines
+from utils.tokenizer import Tokenizer, ApproximateTokenizer
+from utils.vector_memory import VectorMemory
 
 
 class History:
@@ -11,11 +16,36 @@ class History:
             self,
             default_prompt: str,
             prompt_model: prompt.Model,
-            conversation_model: conversation.Model
+            conversation_model: conversation.Model,
+            shared_settings: bool = False,
+            templates: Optional[PersonaTemplates] = None,
+            tokenizer: Optional[Tokenizer] = None,
+            memory: Optional[VectorMemory] = None,
+            message_offset: int = 0
     ) -> None:
         self.default_prompt = default_prompt
         self.prompt_model = prompt_model
         self.conversation_model = conversation_model
+        self.templates = templates or PersonaTemplates(default_prompt, prompt_model)
+        self.tokenizer = tokenizer or ApproximateTokenizer()
+        self.memory = memory
+        self.message_offset = message_offset
+
+        self._shared_settings = shared_settings
+
+        self._prompt_key: Optional[Hashable] = None
+        self._prompt = ''
+        self._prompt_tokens = 0
+
+        self._rendered_messages: Optional[List[Message]] = None
+        self._rendered_names: Tuple[Tuple[str, str], ...] = ()
+        self._sender_names: Dict[str, str] = {}
+        self._lines: List[str] = []
+        self._token_sums: List[int] = [0]
+        self._full_messages: Optional[str] = None
+
+        self._memory_key: Optional[Hashable] = None
+        self._memories = ''
 
     @property
     def traits(self) -> List[Trait]:
@@ -40,6 +70,14 @@ class History:
     @settings.setter
     def settings(self, settings: conversation.Settings) -> None:
         self.conversation_model.settings = settings
+        self._shared_settings = False
+
+    def edit_settings(self) -> conversation.Settings:
+        """Return settings that are safe to modify, copying them first if shared with the template."""
+        if self._shared_settings:
+            self.settings = self.settings.copy(deep=True)
+
+        return self.settings
 
     @property
     def messages(self) -> List[Message]:
@@ -49,13 +87,21 @@ class History:
     def messages(self, messages: List[Message]) -> None:
         self.conversation_model.messages = messages
 
+    @property
+    def summary(self) -> str:
+        return self.conversation_model.summary
+
+    @summary.setter
+    def summary(self, summary: str) -> None:
+        self.conversation_model.summary = summary
+
     @property
     def participants(self) -> List[conversation.Participant]:
         return self.settings.participants
 
     @participants.setter
     def participants(self, participants: List[conversation.Participant]) -> None:
-        self.settings.participants = participants
+        self.edit_settings().participants = participants
 
     @property
     def user_traits(self) -> List[UserTrait]:
@@ -63,73 +109,213 @@ class History:
 
     @user_traits.setter
     def user_traits(self, user_traits: List[UserTrait]) -> None:
-        self.settings.traits = user_traits
+        self.edit_settings().traits = user_traits
+
+    def estimate_size(self) -> int:
+        size = sum(len(message.text) for message in self.messages)
+        return size + self.memory.nbytes if self.memory else size
 
     def get_prompt_history(self) -> str:
         full_prompt = self.get_full_prompt()
         full_messages = self.get_full_messages()
+        memories = self.get_memories()
 
-        contents = trim((full_prompt, full_messages))
+        contents = trim((full_prompt, memories, full_messages))
         return '\n\n'.join(contents)
 
+    def get_memories(self) -> str:
+        """Scrolled-out lines most similar to the latest user message, as a "[Memories]" section."""
+        if not self.memory:
+            return ''
+
+        self.get_message_lines()
+        query = next((message.text for message in reversed(self.messages) if message.sender == 'user'), '')
+
+        key = query, self.message_offset, len(self.memory)
+        if key != self._memory_key:
+            memories = self.memory.search(query, self.message_offset) if query else []
+            lines = '\n'.join(line for _, _, line in sorted(memories))
+            self._memories = f"[Memories]\n{lines}" if lines else ''
+            self._memory_key = key
+
+        return self._memories
+
+    def embed_memories(self, messages: Iterable[Message], batch_size: int = 4096) -> Optional[VectorMemory]:
+        """Index scrolled-out messages, numbered from 0, into a new memory to be put in front of `memory`.
+        Nothing of the history is changed, so this can run in a worker thread."""
+        if self.memory is None:
+            return None
+
+        memory = self.memory.create_empty()
+
+        batch = []
+        for message_id, message in enumerate(messages):
+            batch.append((message_id, message))
+            if len(batch) >= batch_size:
+                self._add_memories(memory, batch)
+                batch = []
+
+        self._add_memories(memory, batch)
+        return memory
+
+    def _add_memories(self, memory: VectorMemory, messages: Sequence[Tuple[int, Message]]) -> None:
+        ids = [message_id for message_id, _ in messages]
+        texts = [message.text for _, message in messages]
+        lines = [self.format_message(message) for _, message in messages]
+        memory.add(ids, texts, lines)
+
     def get_full_prompt(self) -> str:
-        default_prompt_section = self.default_prompt
-        prompt_sections = self.get_prompt_sections()
-        user_prompt_section = self.get_user_prompt_section()
-        prompts = trim((default_prompt_section, *prompt_sections, user_prompt_section))
+        """The rendered static prefix, rebuilt only when the persona, the user prompt or the summary change."""
+        key = self._get_prompt_key()
+        if key != self._prompt_key:
+            self._prompt = self._render_full_prompt()
+            self._prompt_tokens = self.tokenizer.count(self._prompt)
+            self._prompt_key = key
+
+        return self._prompt
 
-        names = (p.name for p in self.participants)
-        return '\n\n'.join(prompts).format(*names)
+    def count_prompt_tokens(self) -> int:
+        """Uncalibrated token count of the static prefix."""
+        self.get_full_prompt()
+        return self._prompt_tokens
 
-    def get_prompt_sections(self) -> Iterator[str]:
+    def count_message_tokens(self, start: int = 0) -> int:
+        """Uncalibrated token count of the rendered messages from `start` on."""
+        self.get_message_lines()
+        return self._token_sums[-1] - self._token_sums[start]
+
+    def count_prompt_history_tokens(self) -> int:
+        # The prefix and the messages are joined by a blank line under a "[Messages]" header.
+        return self.count_prompt_tokens() + self.count_memory_tokens() + self.count_message_tokens() + 4
+
+    def count_memory_tokens(self) -> int:
+        return self.tokenizer.count(self.get_memories())
+
+    def find_cut_index(self, budget: int) -> int:
+        """Index of the oldest message to keep so that the messages from there on fit into `budget` tokens."""
+        self.get_message_lines()
+
+        kept_tokens = budget / self.tokenizer.scale
+        return bisect.bisect_left(self._token_sums, self._token_sums[-1] - kept_tokens, 0, len(self._lines))
+
+    def _get_prompt_key(self) -> Hashable:
+        traits = tuple((trait.category, trait.style) for trait in self.user_traits)
+        participants = tuple((p.role, p.name) for p in self.participants)
+        return id(self.traits), traits, participants, self.settings.userPrompt, self.summary
+
+    def _render_full_prompt(self) -> str:
+        if self.templates.source is not self.traits:
+            self.templates = PersonaTemplates(self.default_prompt, self.prompt_model)
+
+        names = [p.name for p in self.participants]
+
+        default_prompt_section = self.templates.default_prompt.render(names)
+        prompt_sections = self.get_prompt_sections(names)
+        user_prompt_section = self.get_user_prompt_section(names)
+        summary_section = f"[Summary]\n{self.summary}" if self.summary else ''
+        prompts = trim((default_prompt_section, *prompt_sections, user_prompt_section, summary_section))
+
+        return '\n\n'.join(prompts)
+
+    def get_prompt_sections(self, names: Sequence[str]) -> Iterator[str]:
         for user_trait in self.user_traits:
-            prompt_section = self.get_prompt_section(user_trait)
+            prompt_section = self.get_prompt_section(user_trait, names)
             if prompt_section:
                 yield prompt_section
 
-    def get_user_prompt_section(self) -> str:
+    def get_user_prompt_section(self, names: Sequence[str]) -> str:
         user_prompt = self.settings.userPrompt
-        return f"[Note]\n{user_prompt}" if user_prompt else ''
+        return Template.compile(user_prompt, "[Note]\n").render(names) if user_prompt else ''
 
-    def get_prompt_section(self, user_trait: UserTrait) -> str:
-        sentences = self.get_prompt(user_trait)
-        if not sentences:
-            return ''
-
-        category = user_trait.category.capitalize()
-        style = user_trait.style.capitalize()
-
-        return f"[{category}: {style}]\n{sentences}"
-
-    def get_prompt(self, user_trait: UserTrait) -> str:
+    def get_prompt_section(self, user_trait: UserTrait, names: Sequence[str]) -> str:
         if user_trait.style == 'none':
             return ''
 
-        trait = self.get_trait(user_trait.category)
-        if not trait:
-            return ''
+        template = self.templates.get_section(user_trait.category, user_trait.style)
+        return template.render(names) if template else ''
 
-        choice = self.get_choice(trait.choices, user_trait.style)
-        if not choice:
-            return ''
+    def get_trait(self, category: str) -> Optional[Trait]:
+        return self.templates.traits.get(category)
 
-        return '\n'.join(choice.prompts) if choice.prompts else ''
+    def get_full_messages(self) -> str:
+        lines = self.get_message_lines()
+        if self._full_messages is None:
+            full_message = '\n'.join(lines)
+            self._full_messages = f"[Messages]\n{full_message}" if full_message else "[Messages]"
+
+        return self._full_messages
+
+    def get_page_lines(self, debug: bool = False) -> Sequence[str]:
+        """Lines of `get_prompt_history` if `debug`, else of `get_full_messages`, sharing the rendered messages."""
+        sections = (self.get_full_prompt(), self.get_memories(), "[Messages]") if debug else ("[Messages]",)
+        header = '\n\n'.join(trim(sections)).split('\n')
+        return ChainedLines(header, self.get_message_lines())
+
+    def get_message_lines(self) -> List[str]:
+        """Rendered messages, kept in step with `messages`.
+
+        Appends are rendered incrementally. Replacing the list or renaming participants re-renders everything,
+        and in-place edits must be reported with `invalidate_messages`."""
+        messages = self.messages
+        names = tuple((p.role, p.name) for p in self.participants)
+
+        if messages is not self._rendered_messages or names != self._rendered_names:
+            self._rendered_messages = messages
+            self._rendered_names = names
+            self._sender_names = {role: name for role, name in reversed(names)}
+            self.invalidate_messages()
+
+        if len(self._lines) != len(messages):
+            del self._lines[len(messages):]
+            del self._token_sums[len(self._lines) + 1:]
+
+            start = len(self._lines)
+            for message in messages[start:]:
+                line = self.format_message(message)
+                self._lines.append(line)
+                self._token_sums.append(self._token_sums[-1] + self.tokenizer.count(line) + 1)
+
+            if self.memory is not None:
+                first_id = self.message_offset + start
+                self._add_memories(self.memory, list(enumerate(messages[start:], first_id)))
+
+            self._full_messages = None
+
+        return self._lines
+
+    def drop_messages(self, count: int) -> List[Message]:
+        """Remove the oldest `count` messages in place, shifting their renderings instead of rebuilding them."""
+        messages = self.messages
+        dropped = messages[:count]
+        del messages[:count]
+
+        # Message ids stay the same, so the memory keeps indexing the dropped messages.
+        self.message_offset += len(dropped)
+
+        if messages is self._rendered_messages and len(self._lines) >= len(dropped):
+            dropped_tokens = self._token_sums[len(dropped)]
+            del self._lines[:len(dropped)]
+            self._token_sums = [total - dropped_tokens for total in self._token_sums[len(dropped):]]
+            self._full_messages = None
+        else:
+            self.invalidate_messages()
 
-    def get_trait(self, category: str) -> Optional[Trait]:
-        return next((trait for trait in self.traits if trait.category == category), None)
+        return dropped
 
-    def get_choice(self, choices: Iterable[Choice], style: str) -> Optional[Choice]:
-        return next((choice for choice in choices if choice.style == style), None)
+    def invalidate_messages(self, start: int = 0) -> None:
+        """Forget the rendering of messages from `start` on; negative values count from the end."""
+        if start < 0:
+            start = max(len(self._lines) + start, 0)
 
-    def get_full_messages(self) -> str:
-        full_message = '\n'.join(self.format_message(message) for message in self.messages)
-        if not full_message:
-            return "[Messages]"
+        del self._lines[start:]
+        del self._token_sums[start + 1:]
+        self._full_messages = None
 
-        return f"[Messages]\n{full_message}"
+        if self.memory is not None:
+            self.memory.truncate(self.message_offset + start)
 
     def format_message(self, message: Message) -> str:
-        sender_name = self.get_sender_name(message.sender)
+        sender_name = self._sender_names.get(message.sender)
         if sender_name:
             return f"{sender_name}: {message.text}"
         else:
@@ -0,0 +1,91 @@
+from string import Formatter
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from data import prompt
+
+Slot = Tuple[int, Optional[str], str]
+Fragment = Union[str, Slot]
+
+
+class Template:
+    """Text pre-split into literal fragments and positional name slots, rendered with a single join."""
+
+    def __init__(self, fragments: List[Fragment]) -> None:
+        self.fragments = fragments
+
+        self._parts = [fragment if isinstance(fragment, str) else '' for fragment in fragments]
+        self._slots = [(position, fragment) for position, fragment in enumerate(fragments) if not isinstance(fragment, str)]
+        self._plain = all(conversion is None and not spec for _, (_, conversion, spec) in self._slots)
+
+    @classmethod
+    def compile(cls, text: str, prefix: str = '') -> 'Template':
+        try:
+            fragments = list(cls._parse(text))
+        except ValueError:
+            fragments = [text]
+
+        return cls([prefix, *fragments] if prefix else fragments)
+
+    @staticmethod
+    def _parse(text: str) -> Iterator[Fragment]:
+        auto_index = 0
+        for literal, field, spec, conversion in Formatter().parse(text):
+            if literal:
+                yield literal
+
+            if field is None:
+                continue
+
+            if field == '':
+                index = auto_index
+                auto_index += 1
+            elif field.isdigit():
+                index = int(field)
+            else:
+                raise ValueError(f"Unsupported field '{field}'")
+
+            yield index, conversion, spec
+
+    def render(self, names: Sequence[str]) -> str:
+        if not self._slots:
+            return ''.join(self._parts)
+
+        parts = self._parts.copy()
+        if self._plain:
+            for position, (index, _, _) in self._slots:
+                parts[position] = names[index]
+        else:
+            for position, slot in self._slots:
+                parts[position] = self._render_slot(slot, names)
+
+        return ''.join(parts)
+
+    @staticmethod
+    def _render_slot(slot: Slot, names: Sequence[str]) -> str:
+        index, conversion, spec = slot
+        value = names[index]
+        if conversion == 'r':
+            value = repr(value)
+        elif conversion == 'a':
+            value = ascii(value)
+
+        return format(value, spec) if spec else str(value)
+
+
+class PersonaTemplates:
+    """prompt.txt and prompt.yaml compiled once into templates, with trait sections indexed by (category, style)."""
+
+    def __init__(self, default_prompt: str, prompt_model: prompt.Model) -> None:
+        self.source = prompt_model.traits
+        self.default_prompt = Template.compile(default_prompt)
+        self.traits: Dict[str, prompt.Trait] = {trait.category: trait for trait in prompt_model.traits}
+        self.sections: Dict[Tuple[str, str], Template] = {}
+
+        for trait in prompt_model.traits:
+            for choice in trait.choices:
+                if choice.prompts:
+                    header = f"[{trait.category.capitalize()}: {choice.style.capitalize()}]\n"
+                    self.sections[trait.category, choice.style] = Template.compile('\n'.join(choice.prompts), header)
+
+    def get_section(self, category: str, style: str) -> Optional[Template]:
+        return self.sections.get((category, style))
@@ -6,6 +6,7 @@ from colorama import Fore, Style
 
 from scripts.bot import DiscordBot
 from scripts.config import AppConfig
+from scripts.sharding import ShardSupervisor
 
 logging.basicConfig(level=logging.INFO)
 
@@ -29,7 +30,10 @@ async def main(app_config: AppConfig) -> None:
 if __name__ == '__main__':
     try:
         config = AppConfig(CONFIG_PATH)
-        asyncio.run(main(config))
+        if config.shard_count > 1:
+            ShardSupervisor(CONFIG_PATH, config).run()
+        else:
+            asyncio.run(main(config))
     except KeyboardInterrupt:
         warning(
             "[System] Keyboard Interrupted.\n"
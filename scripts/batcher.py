@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import openai
+
+from scripts.completion import CompletionBackend, CompletionRequest
+from scripts.config import AppConfig
+
+BatchKey = Tuple
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.requests: List[CompletionRequest] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class CompletionBatcher(CompletionBackend):
+    """Collects concurrent completions for `window` seconds and sends those with identical
+    sampling parameters as one multi-prompt request, so a batch costs a single request of the rate limit.
+
+    Streams are passed through unbatched. If a batch is rejected as invalid, its prompts are
+    sent again one by one, so only the offending session sees the error."""
+
+    def __init__(self, backend: CompletionBackend, window: float, max_size: int) -> None:
+        self.backend = backend
+        self.window = window
+        self.max_size = max_size
+
+        self._batches: Dict[BatchKey, _Batch] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.batched_requests = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            'batches': self.batches,
+            'batched_requests': self.batched_requests,
+            'average_batch_size': self.batched_requests / self.batches if self.batches else 0.0,
+        }
+
+    async def complete(self, request: CompletionRequest) -> str:
+        texts = await self._submit(request)
+        return texts[0]
+
+    async def complete_many(self, request: CompletionRequest) -> List[str]:
+        return await self._submit(request)
+
+    async def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        async for piece in self.backend.stream(request):
+            yield piece
+
+    async def close(self) -> None:
+        for key in list(self._batches):
+            self._flush(key)
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        await self.backend.close()
+
+    @staticmethod
+    def _get_key(request: CompletionRequest) -> BatchKey:
+        return (
+            request.engine,
+            request.max_tokens,
+            request.temperature,
+            request.top_p,
+            request.frequency_penalty,
+            request.presence_penalty,
+            tuple(request.stop),
+            request.n,
+        )
+
+    async def _submit(self, request: CompletionRequest) -> List[str]:
+        loop = asyncio.get_running_loop()
+        key = self._get_key(request)
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch()
+            batch.timer = loop.call_later(self.window, self._flush, key)
+
+        future = loop.create_future()
+        batch.requests.append(request)
+        batch.futures.append(future)
+
+        if len(batch.requests) >= self.max_size:
+            self._flush(key)
+
+        return await future
+
+    def _flush(self, key: BatchKey) -> None:
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+
+        batch.timer.cancel()
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: _Batch) -> None:
+        self.batches += 1
+        self.batched_requests += len(batch.requests)
+
+        try:
+            if len(batch.requests) == 1:
+                results = [await self.backend.complete_many(batch.requests[0])]
+            else:
+                results = await self.backend.complete_batch(batch.requests)
+        except Exception as e:
+            if isinstance(e, openai.error.InvalidRequestError) and len(batch.requests) > 1:
+                logging.info(f"[Batcher] Batch of {len(batch.requests)} was rejected, sending them one by one.")
+                await asyncio.gather(*(
+                    self._send_one(request, future) for request, future in zip(batch.requests, batch.futures)
+                ))
+                return
+
+            for future in batch.futures:
+                self._set_exception(future, e)
+            return
+
+        for future, texts in zip(batch.futures, results):
+            if not future.done():
+                future.set_result(texts)
+
+    async def _send_one(self, request: CompletionRequest, future: asyncio.Future) -> None:
+        if future.done():
+            return
+
+        try:
+            texts = await self.backend.complete_many(request)
+        except Exception as e:
+            self._set_exception(future, e)
+            return
+
+        if not future.done():
+            future.set_result(texts)
+
+    @staticmethod
+    def _set_exception(future: asyncio.Future, error: BaseException) -> None:
+        if not future.done():
+            future.set_exception(error)
+
+
+def create_batcher(config: AppConfig, backend: CompletionBackend) -> CompletionBackend:
+    if not config.batch_enabled:
+        return backend
+
+    return CompletionBatcher(backend, config.batch_window, config.batch_max_size)
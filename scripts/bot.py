@@ -1,62 +1,206 @@
 import asyncio
-import inspect
 import logging
+import tempfile
 from asyncio import Task
-from typing import Any, Iterator, Tuple
+from typing import Any, Callable, Coroutine, Dict, Iterator, List, Optional, Protocol, Set
 
 import discord
 from colorama import Fore, Style
 from discord import app_commands, Object, Interaction
 
+from data.conversation import Message
+from scripts.batcher import create_batcher
 from scripts.cache_manager import CacheManager
+from scripts.command_sync import CommandSync
+from scripts.completion import OpenAiBackend
 from scripts.config import AppConfig
 from scripts.conversation import Conversation
+from scripts.instrumentation import REGISTRY, MetricsServer, current_command, instrument_command, phase
 from scripts.ko_kr import *
+from scripts.scheduler import create_scheduler
+from scripts.message_stream import FollowupStream
+from scripts.page_view import PageView
+from scripts.resilience import CompletionError, CircuitOpenError, create_resilient_backend
+from scripts.reroll_buffer import create_reroll_buffer
+from scripts.reroll_view import RerollView
+from scripts.session_store import SessionLeaseError
+from scripts.summarizer import create_summarizer
+from utils.lru_cache import LruCache
+from utils.metrics import Gauge, Labels
+from utils.pagination import Page
 from utils.parser import try_parse_int
 
 
 # TODO: 인격 슬롯 3개 변경 가능하게 추가
-# TODO: 리롤 버튼 추가
 # TODO: AI랑 순서 바꾸는 기능 추가
 
 
+class EventLike(Protocol):
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        ...
+
+
 def info(message: str) -> None:
     logging.info(f"{Fore.WHITE}{Style.BRIGHT}{message}{Style.RESET_ALL}")
 
 
 class DiscordBot(discord.Client):
-    def __init__(self, config: AppConfig) -> None:
+    """With a `shard_id`, this process serves one of `SHARD_COUNT` gateway shards and leases the sessions it loads
+    as `lease_owner`. It then stops when `stop_event` is set instead of waiting for Enter."""
+
+    def __init__(
+            self,
+            config: AppConfig,
+            shard_id: Optional[int] = None,
+            lease_owner: str = '',
+            previous_owner: str = '',
+            stop_event: Optional[EventLike] = None
+    ) -> None:
         intents = discord.Intents.default()
         intents.message_content = True
 
-        super().__init__(intents=intents)
+        if shard_id is None:
+            super().__init__(intents=intents)
+        else:
+            super().__init__(intents=intents, shard_id=shard_id, shard_count=config.shard_count)
 
         self.config = config
+        self.stop_event = stop_event
 
         self._tree = app_commands.CommandTree(self)
         self._command = self._tree.command
         self._guilds = list(self.initialize_guilds())
+        self.command_sync = CommandSync(self._tree, config.command_sync_path, config.command_sync_concurrency)
 
-        self.cache_manager = CacheManager(config)
-        self.conversations = dict(self.initialize_conversations())
+        self.cache_manager = CacheManager(config, lease_owner, previous_owner)
+        self.backend = create_batcher(
+            config, create_resilient_backend(config, create_scheduler(config, OpenAiBackend(config)))
+        )
+        self.summarizer = create_summarizer(config, self.backend)
+        self.rerolls = create_reroll_buffer(config, self.backend)
+        self.conversations: LruCache[str, Conversation] = LruCache(
+            max_size=config.max_resident_sessions,
+            max_weight=config.session_memory_budget,
+            max_idle=config.session_idle_timeout,
+            weigh=lambda conversation: conversation.cache.estimate_size(),
+            on_evict=self.release_conversation,
+            # A session waits for its summary before it is released, or the summary would be lost.
+            can_evict=lambda conversation: not conversation.busy and not conversation.summarizing
+        )
+
+        # Each shard serves its own metrics, on consecutive ports.
+        metrics_port = config.metrics_port + (shard_id or 0)
+        self.metrics = MetricsServer(REGISTRY, config.metrics_host, metrics_port) if config.metrics_enabled else None
+        self._lease_task: Optional[Task] = None
+        self._sweep_task: Optional[Task] = None
+        self._tasks: Set[Task] = set()
+        self._gauges: List[Gauge] = []
+        self._register_gauges()
 
         self._add_events()
         self._add_commands()
 
-    def get_conversation(self, interaction: Interaction):
+    async def get_conversation(self, interaction: Interaction) -> Conversation:
         session_id = str(interaction.channel_id)
-        if session_id in self.conversations:
-            return self.conversations[session_id]
-        else:
-            cache = self.cache_manager.get(str(session_id))
-            conversation = Conversation(self.config, self.cache_manager, cache)
-            self.conversations[session_id] = conversation
-            return conversation
-
-    def initialize_conversations(self) -> Iterator[Tuple[str, Conversation]]:
-        for cache in self.cache_manager.get_all():
-            session = cache.conversation_model.session
-            yield session.id, Conversation(self.config, self.cache_manager, cache)
+        conversation = self.conversations.get(session_id)
+        if conversation is None:
+            # Writes left from before the session was released are finished off the loop, so loading it does not block.
+            await self.cache_manager.flush(session_id)
+            conversation = self.conversations.get(session_id)
+
+        if conversation is None:
+            cache = self.cache_manager.get(session_id)
+            conversation = Conversation(
+                self.config, self.cache_manager, cache, self.backend, self.summarizer, self.rerolls
+            )
+            self.conversations.put(session_id, conversation)
+            self._start_task(self.cache_manager.load_memories(cache))
+
+        return conversation
+
+    def _start_task(self, coroutine: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._finish_task)
+
+    def _finish_task(self, task: Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("[System] Background task failed.", exc_info=task.exception())
+
+    def release_conversation(self, session_id: str, conversation: Conversation) -> None:
+        info(f"[System] Releasing idle session '{session_id}'...")
+        conversation.close()
+        self.cache_manager.release(session_id)
+
+    def _register_gauges(self) -> None:
+        """Gauges read this bot, so they are registered for its lifetime and unregistered when it stops."""
+        self._gauges.append(REGISTRY.register(Gauge(
+            'aigf_sessions', "Sessions resident in memory, and those running a command.",
+            lambda: {
+                ('resident',): len(self.conversations),
+                ('busy',): sum(1 for conversation in self.conversations.values() if conversation.busy),
+            },
+            ('state',)
+        )))
+        self._gauges.append(REGISTRY.register(Gauge(
+            'aigf_backend', "Statistics reported by each layer of the completion backend.",
+            self._collect_backend_stats,
+            ('layer', 'stat')
+        )))
+
+    def _unregister_gauges(self) -> None:
+        for gauge in self._gauges:
+            REGISTRY.unregister(gauge.name)
+
+        self._gauges.clear()
+
+    def _collect_backend_stats(self) -> Dict[Labels, float]:
+        stats = {}
+        layer = self.backend
+        while layer is not None:
+            if hasattr(layer, 'get_stats'):
+                for key, value in layer.get_stats().items():
+                    stats[(type(layer).__name__, key)] = value
+
+            layer = getattr(layer, 'backend', None)
+
+        return stats
+
+    async def setup_hook(self) -> None:
+        if self.metrics is not None:
+            await self.metrics.start()
+
+        if self.cache_manager.lease_owner:
+            self._lease_task = asyncio.create_task(self.renew_leases())
+
+        if self.config.session_sweep_interval > 0:
+            self._sweep_task = asyncio.create_task(self.sweep_conversations())
+
+    async def sweep_conversations(self) -> None:
+        # Eviction otherwise only runs when a session is loaded, so idle and skipped busy sessions would stay.
+        while True:
+            await asyncio.sleep(self.config.session_sweep_interval)
+            try:
+                self.conversations.evict()
+            except Exception:
+                logging.exception("[System] Failed to release idle sessions.")
+
+    async def renew_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.lease_renew_interval)
+            try:
+                lost = self.cache_manager.renew_leases()
+            except Exception:
+                logging.exception("[Lease] Failed to renew session leases.")
+                continue
+
+            for session_id in lost:
+                # Another process owns the session now; drop it without writing anything back.
+                logging.warning(f"[Lease] Lost the lease of session '{session_id}'.")
+                conversation = self.conversations.pop(session_id)
+                if conversation is not None:
+                    conversation.close()
 
     def initialize_guilds(self) -> Iterator[Object]:
         for guild in self.config.server_guilds:
@@ -78,8 +222,11 @@ class DiscordBot(discord.Client):
         info("[System] Discord Bot terminated.")
 
     async def wait_for_exit(self) -> None:
-        message = "[System] Press Enter to exit bot..."
-        await asyncio.to_thread(input, f'{message}\n')
+        if self.stop_event is not None:
+            await asyncio.to_thread(self.stop_event.wait)
+        else:
+            message = "[System] Press Enter to exit bot..."
+            await asyncio.to_thread(input, f'{message}\n')
 
         info("[System] Changing presence to offline...")
         await self.change_presence(status=discord.Status.offline)
@@ -87,6 +234,26 @@ class DiscordBot(discord.Client):
         info("[System] Stopping Discord Bot...")
         await self.close()
 
+        for task in (self._lease_task, self._sweep_task, *self._tasks):
+            if task is not None:
+                task.cancel()
+
+        if self.summarizer is not None:
+            info("[System] Finishing pending summaries...")
+            await self.summarizer.drain()
+
+        info("[System] Closing completion client...")
+        if self.rerolls is not None:
+            self.rerolls.close()
+        await self.backend.close()
+
+        info("[System] Flushing pending session writes...")
+        self.cache_manager.close()
+
+        if self.metrics is not None:
+            await self.metrics.close()
+        self._unregister_gauges()
+
         info("[System] Discord Bot stopped.")
 
     def _add_events(self) -> None:
@@ -96,16 +263,30 @@ class DiscordBot(discord.Client):
             game = discord.Game("/도움말")
             await self.change_presence(status=discord.Status.online, activity=game)
 
+            if self.shard_id:
+                # Commands are global to the application; the first shard syncs them for everyone.
+                info("[Event] Discord Bot is ready.")
+                return
+
             info("[Event] Syncing server commands...")
-            for guild in self._guilds:
-                try:
-                    info(f"[Event] Syncing commands in '{guild.id}'...")
-                    await self._tree.sync(guild=guild)
-                except discord.errors.Forbidden:
-                    info(f"[Event] Failed to sync commands in '{guild.id}' due to insufficient permissions.")
+            await self.command_sync.sync(self._guilds)
 
             info("[Event] Discord Bot is ready.")
 
+        @self._tree.error
+        async def on_app_command_error(interaction: Interaction, error: app_commands.AppCommandError) -> None:
+            if isinstance(getattr(error, 'original', None), SessionLeaseError):
+                info(f"[Lease] Session '{interaction.channel_id}' is leased by another process.")
+                # noinspection PyUnresolvedReferences
+                if interaction.response.is_done():
+                    await interaction.followup.send(SESSION_LEASED, ephemeral=True)
+                else:
+                    await interaction.response.send_message(SESSION_LEASED, ephemeral=True)
+                return
+
+            name = interaction.command.name if interaction.command is not None else None
+            logging.error(f"[Event] Error occurred in command '{name}'.", exc_info=error)
+
         @self.event
         async def on_error(event_method: str, /, *args: Any, **kwargs: Any) -> None:
             logging.exception(f"[Event] Error occurred in '{event_method}' event.")
@@ -113,23 +294,112 @@ class DiscordBot(discord.Client):
             logging.error(f"[Event] Kwargs: {kwargs}")
 
     def _add_commands(self) -> None:
+        def command(name: str, description: str) -> Callable:
+            register = self._command(name=name, description=description, guilds=self._guilds)
+
+            def decorator(callback: Callable) -> Callable:
+                return register(instrument_command(callback.__name__.lstrip('_'), callback))
+
+            return decorator
+
         def log_callback(interaction: Interaction) -> None:
-            info(f"[Callback] {inspect.stack()[1][3]} / {interaction.channel_id}")
+            info(f"[Callback] {current_command.get()} / {interaction.channel_id}")
 
         async def defer(interaction: Interaction) -> None:
-            info(f"[Defer] {inspect.stack()[1][3]} / {interaction.channel_id}")
+            info(f"[Defer] {current_command.get()} / {interaction.channel_id}")
+            with phase('defer'):
+                # noinspection PyUnresolvedReferences
+                await interaction.response.defer()
+
+        async def follow(
+                interaction: Interaction,
+                message: str,
+                stream: Optional[FollowupStream] = None,
+                view: discord.ui.View = discord.utils.MISSING
+        ) -> None:
+            info(f"[Follow] {current_command.get()} / {interaction.channel_id}")
+            with phase('followup'):
+                if stream is not None:
+                    await stream.finish(message, view)
+                else:
+                    # noinspection PyUnresolvedReferences
+                    await interaction.followup.send(message, view=view)
+
+        async def send(interaction: Interaction, message: str) -> None:
+            info(f"[Send] {current_command.get()} / {interaction.channel_id}")
+            with phase('followup'):
+                # noinspection PyUnresolvedReferences
+                if interaction.response.is_done():
+                    await interaction.followup.send(message)
+                else:
+                    await interaction.response.send_message(message)
+
+        async def wait_for(interaction: Interaction, conversation: Conversation) -> None:
+            # Commands queued behind a running prediction must acknowledge the interaction in time.
+            if conversation.busy:
+                await defer(interaction)
+
+        def get_completion_error(error: CompletionError) -> str:
+            logging.warning(f"[Completion] {error}", exc_info=error.__cause__)
+            return COMPLETION_UNAVAILABLE if isinstance(error, CircuitOpenError) else COMPLETION_FAILED
+
+        async def reroll(interaction: Interaction, timestamp: str) -> None:
+            log_callback(interaction)
+
             # noinspection PyUnresolvedReferences
             await interaction.response.defer()
 
-        async def follow(interaction: Interaction, message: str) -> None:
-            info(f"[Follow] {inspect.stack()[1][3]} / {interaction.channel_id}")
-            # noinspection PyUnresolvedReferences
-            await interaction.followup.send(message)
+            conversation = await self.get_conversation(interaction)
+            try:
+                prediction = await conversation.retry(timestamp=timestamp)
+            except CompletionError as e:
+                await interaction.followup.send(get_completion_error(e), ephemeral=True)
+                return
 
-        async def send(interaction: Interaction, message: str) -> None:
-            info(f"[Send] {inspect.stack()[1][3]} / {interaction.channel_id}")
-            # noinspection PyUnresolvedReferences
-            await interaction.response.send_message(message)
+            if prediction is None:
+                await interaction.followup.send(REROLL_EXPIRED, ephemeral=True)
+                return
+
+            result = conversation.format_prediction(*prediction)
+
+            await interaction.edit_original_response(content=result, view=create_reroll_view(prediction[1]))
+
+        reroll = instrument_command('reroll', reroll)
+
+        def create_reroll_view(answer: Message) -> RerollView:
+            return RerollView(answer.timestamp, reroll)
+
+        def create_page_view(page: Page, debug: bool) -> PageView:
+            async def get_page(interaction: Interaction, start: Optional[int], end: Optional[int]) -> Page:
+                conversation = await self.get_conversation(interaction)
+                return conversation.debug(start, end) if debug else conversation.print(start, end)
+
+            return PageView(page, get_page)
+
+        async def send_page(interaction: Interaction, page: Page, debug: bool) -> None:
+            info(f"[Send] {current_command.get()} / {interaction.channel_id}")
+            with phase('followup'):
+                # noinspection PyUnresolvedReferences
+                await interaction.response.send_message(page.text, view=create_page_view(page, debug))
+
+        async def send_export(interaction: Interaction, conversation: Conversation) -> None:
+            await defer(interaction)
+
+            # Spilled to disk past a megabyte, so a long history is never held in memory.
+            with tempfile.SpooledTemporaryFile(max_size=2 ** 20) as file:
+                with phase('export'):
+                    await conversation.export(file)
+
+                limit = interaction.guild.filesize_limit if interaction.guild else 8 * 2 ** 20
+                if file.tell() > limit:
+                    await follow(interaction, EXPORT_TOO_LARGE)
+                    return
+
+                file.seek(0)
+                info(f"[Follow] {current_command.get()} / {interaction.channel_id}")
+                with phase('followup'):
+                    # noinspection PyUnresolvedReferences
+                    await interaction.followup.send(file=discord.File(file, f'{interaction.channel_id}.txt.gz'))
 
         def get_styles(category: str) -> Iterator[str]:
             for trait in self.cache_manager.default_history.prompt_model.traits:
@@ -147,25 +417,26 @@ class DiscordBot(discord.Client):
         categories = list(get_categories())
         choices = {category: get_choices(category) for category in categories}
 
-        decorator_help = self._command(name=HELP, description=HELP_DESC, guilds=self._guilds)
-        decorator_send = self._command(name=SEND, description=SEND_DESC, guilds=self._guilds)
-        decorator_retry = self._command(name=RETRY, description=RETRY_DESC, guilds=self._guilds)
-        decorator_record = self._command(name=RECORD, description=RECORD_DESC, guilds=self._guilds)
-        decorator_replace = self._command(name=REPLACE, description=REPLACE_DESC, guilds=self._guilds)
-        decorator_modify = self._command(name=MODIFY, description=MODIFY_DESC, guilds=self._guilds)
-        decorator_rename = self._command(name=RENAME, description=RENAME_DESC, guilds=self._guilds)
-        decorator_swap = self._command(name=SWAP, description=SWAP_DESC, guilds=self._guilds)
-        decorator_undo = self._command(name=UNDO, description=UNDO_DESC, guilds=self._guilds)
-        decorator_clear = self._command(name=CLEAR, description=CLEAR_DESC, guilds=self._guilds)
-        decorator_reset = self._command(name=RESET, description=RESET_DESC, guilds=self._guilds)
-        decorator_print = self._command(name=PRINT, description=PRINT_DESC, guilds=self._guilds)
-        decorator_debug = self._command(name=DEBUG, description=DEBUG_DESC, guilds=self._guilds)
-        decorator_config = self._command(name=CONFIG, description=CONFIG_DESC, guilds=self._guilds)
+        decorator_help = command(HELP, HELP_DESC)
+        decorator_send = command(SEND, SEND_DESC)
+        decorator_retry = command(RETRY, RETRY_DESC)
+        decorator_record = command(RECORD, RECORD_DESC)
+        decorator_replace = command(REPLACE, REPLACE_DESC)
+        decorator_modify = command(MODIFY, MODIFY_DESC)
+        decorator_rename = command(RENAME, RENAME_DESC)
+        decorator_swap = command(SWAP, SWAP_DESC)
+        decorator_undo = command(UNDO, UNDO_DESC)
+        decorator_clear = command(CLEAR, CLEAR_DESC)
+        decorator_reset = command(RESET, RESET_DESC)
+        decorator_print = command(PRINT, PRINT_DESC)
+        decorator_debug = command(DEBUG, DEBUG_DESC)
+        decorator_config = command(CONFIG, CONFIG_DESC)
 
         decorator_send_describe = app_commands.describe(message=SEND_ARGS_1)
         decorator_record_describe = app_commands.describe(prompt=RECORD_ARGS_1)
         decorator_replace_describe = app_commands.describe(before=REPLACE_ARGS_1, after=REPLACE_ARGS_2)
         decorator_modify_describe = app_commands.describe(message=MODIFY_ARGS_1)
+        decorator_print_describe = app_commands.describe(file=PRINT_ARGS_1)
         decorator_rename_describe = app_commands.describe(user=RENAME_ARGS_1, ai=RENAME_ARGS_2)
         decorator_config_describe = app_commands.describe(
             reset=CONFIG_ARGS_1,
@@ -191,11 +462,25 @@ class DiscordBot(discord.Client):
 
             await defer(interaction)
 
-            conversation = self.get_conversation(interaction)
-            prediction = await conversation.send(message)
+            conversation = await self.get_conversation(interaction)
+            stream = FollowupStream(interaction, self.config.stream_edit_interval)
+            try:
+                prediction = await conversation.send(
+                    message,
+                    lambda *partial: stream.update(conversation.format_prediction(*partial)),
+                    lambda: follow(interaction, f"{SEND_QUEUED}\n**{conversation.user_name}**: {message}")
+                )
+            except CompletionError as e:
+                await follow(interaction, get_completion_error(e), stream)
+                return
+
+            if prediction is None:
+                # Queued behind another message and answered in its reply.
+                return
+
             result = conversation.format_prediction(*prediction)
 
-            await follow(interaction, result)
+            await follow(interaction, result, stream, create_reroll_view(prediction[1]))
 
         @decorator_retry
         async def _retry(interaction: Interaction) -> None:
@@ -203,23 +488,32 @@ class DiscordBot(discord.Client):
 
             await defer(interaction)
 
-            conversation = self.get_conversation(interaction)
-            prediction = await conversation.retry()
+            conversation = await self.get_conversation(interaction)
+            stream = FollowupStream(interaction, self.config.stream_edit_interval)
+            try:
+                prediction = await conversation.retry(lambda *partial: stream.update(
+                    conversation.format_prediction(*partial)
+                ))
+            except CompletionError as e:
+                await follow(interaction, get_completion_error(e), stream)
+                return
+
             if prediction is None:
                 await follow(interaction, "[다시 시도할 메시지가 없습니다]")
                 return
 
             result = conversation.format_prediction(*prediction)
 
-            await follow(interaction, result)
+            await follow(interaction, result, stream, create_reroll_view(prediction[1]))
 
         @decorator_record
         @decorator_record_describe
         async def _record(interaction: Interaction, prompt: str) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
-            conversation.record(prompt)
+            conversation = await self.get_conversation(interaction)
+            await wait_for(interaction, conversation)
+            await conversation.record(prompt)
             result = f"[프롬프트를 기록했습니다]\n({prompt})"
 
             await send(interaction, result)
@@ -229,8 +523,9 @@ class DiscordBot(discord.Client):
         async def _replace(interaction: Interaction, before: str, after: str) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
-            conversation.replace(before, after)
+            conversation = await self.get_conversation(interaction)
+            await wait_for(interaction, conversation)
+            await conversation.replace(before, after)
             result = f"[단어를 치환했습니다]\n{before} -> {after}"
 
             await send(interaction, result)
@@ -240,8 +535,9 @@ class DiscordBot(discord.Client):
         async def _modify(interaction: Interaction, message: str) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
-            content = conversation.modify(message)
+            conversation = await self.get_conversation(interaction)
+            await wait_for(interaction, conversation)
+            content = await conversation.modify(message)
             if content is None:
                 result = "[수정할 메시지가 없습니다]"
             else:
@@ -255,10 +551,11 @@ class DiscordBot(discord.Client):
         async def _rename(interaction: Interaction, user: str, ai: str) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
+            conversation = await self.get_conversation(interaction)
+            await wait_for(interaction, conversation)
             previous_user = conversation.user_name
             previous_ai = conversation.ai_name
-            conversation.rename(user, ai)
+            await conversation.rename(user, ai)
             result = f"""[이름이 변경되었습니다]
 - 당신: {previous_user} -> {user}
 - 상대: {previous_ai} -> {ai}"""
@@ -269,10 +566,11 @@ class DiscordBot(discord.Client):
         async def _swap(interaction: Interaction) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
+            conversation = await self.get_conversation(interaction)
+            await wait_for(interaction, conversation)
             previous_user = conversation.user_name
             previous_ai = conversation.ai_name
-            conversation.swap()
+            await conversation.swap()
             result = f"""[이름이 변경되었습니다]
 - 당신: {previous_user} -> {previous_ai}
 - 상대: {previous_ai} -> {previous_user}"""
@@ -283,8 +581,9 @@ class DiscordBot(discord.Client):
         async def _undo(interaction: Interaction) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
-            result = conversation.undo()
+            conversation = await self.get_conversation(interaction)
+            await wait_for(interaction, conversation)
+            result = await conversation.undo()
             if result:
                 result = f"[마지막 대화를 취소했습니다]\n{result}"
             else:
@@ -296,8 +595,9 @@ class DiscordBot(discord.Client):
         async def _clear(interaction: Interaction) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
-            conversation.clear()
+            conversation = await self.get_conversation(interaction)
+            await wait_for(interaction, conversation)
+            await conversation.clear()
             result = "[대화 내용이 비워졌습니다]"
 
             await send(interaction, result)
@@ -306,27 +606,30 @@ class DiscordBot(discord.Client):
         async def _reset(interaction: Interaction) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
-            conversation.reset()
+            conversation = await self.get_conversation(interaction)
+            await wait_for(interaction, conversation)
+            await conversation.reset()
             result = "[모든 설정이 초기화되었습니다]"
 
             await send(interaction, result)
 
         @decorator_print
-        async def _print(interaction: Interaction) -> None:
+        @decorator_print_describe
+        async def _print(interaction: Interaction, file: bool = False) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
-            result = conversation.print()
-            await send(interaction, result)
+            conversation = await self.get_conversation(interaction)
+            if file:
+                await send_export(interaction, conversation)
+            else:
+                await send_page(interaction, conversation.print(), debug=False)
 
         @decorator_debug
         async def _debug(interaction: Interaction) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
-            result = conversation.debug()
-            await send(interaction, result)
+            conversation = await self.get_conversation(interaction)
+            await send_page(interaction, conversation.debug(), debug=True)
 
         @decorator_config
         @decorator_config_describe
@@ -340,26 +643,27 @@ class DiscordBot(discord.Client):
                           relationship: str = None) -> None:
             log_callback(interaction)
 
-            conversation = self.get_conversation(interaction)
+            conversation = await self.get_conversation(interaction)
+            await wait_for(interaction, conversation)
             content = []
 
             if reset:
-                conversation.reset()
+                await conversation.reset()
                 content.append(f"- 초기화: {reset}")
             if user is not None:
-                conversation.rename(user, conversation.ai_name)
+                await conversation.rename(user, conversation.ai_name)
                 content.append(f"- 당신: {user}")
             if ai is not None:
-                conversation.rename(conversation.user_name, ai)
+                await conversation.rename(conversation.user_name, ai)
                 content.append(f"- 상대: {ai}")
             if creativity is not None:
-                conversation.change_creativity(creativity)
+                await conversation.change_creativity(creativity)
                 content.append(f"- 창의성: {creativity}")
             if characteristic is not None:
-                conversation.change_characteristic(characteristic)
+                await conversation.change_characteristic(characteristic)
                 content.append(f"- 성격: {characteristic}")
             if relationship is not None:
-                conversation.change_relationship(relationship)
+                await conversation.change_relationship(relationship)
                 content.append(f"- 관계: {relationship}")
 
             result = '\n'.join(content)
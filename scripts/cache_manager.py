@@ -1,76 +1,264 @@
-import copy
+import asyncio
+import logging
 from datetime import datetime
-from pathlib import Path
-from typing import Optional, Iterable
+from typing import Optional, List, Dict, Iterator, Set, Tuple
 
-from data import prompt_parser, conversation_parser
+from data import prompt_parser, conversation_parser, conversation
+from data.conversation import Message
 from data.history import History
+from data.persona import PersonaTemplates
 from scripts.config import AppConfig
-from utils.file_io import load_txt, save_yaml, remove_file
+from scripts.history_archive import HistoryArchive, Segment
+from scripts.instrumentation import phase
+from scripts.session_journal import Record
+from scripts.session_store import SessionLeaseError, create_session_store
+from scripts.session_writer import create_session_writer
+from utils.file_io import load_txt
+from utils.tokenizer import create_tokenizer
+from utils.vector_memory import VectorMemory, create_embedder
 
 
 class CacheManager:
-    def __init__(self, config: AppConfig) -> None:
+    """Loads and saves sessions. With a `lease_owner`, a session must be leased from the store before it is
+    loaded or written, so processes sharing the store never write the same session."""
+
+    def __init__(self, config: AppConfig, lease_owner: str = '', previous_owner: str = '') -> None:
         self.config = config
+        self.lease_owner = lease_owner
+        self.previous_owner = previous_owner
 
         self._default_prompt = load_txt(self.config.default_prompt_path)
         self._prompt_model = prompt_parser.parse(self.config.prompt_model_path)
         self._conversation_model = conversation_parser.parse(self.config.conversation_model_path)
 
-        self.default_history = History(self._default_prompt, self._prompt_model, self._conversation_model)
+        self._templates = PersonaTemplates(self._default_prompt, self._prompt_model)
+
+        engine_name = self._conversation_model.settings.engineName
+        self.tokenizer = create_tokenizer(self.config.tokenizer, engine_name)
+
+        if self.config.memory_enabled:
+            self.embedder = create_embedder(self.config.embedder, self.config.embedding_dimension)
+        else:
+            self.embedder = None
+
+        self.default_history = self._create_history(self._conversation_model)
+
+        self.store = create_session_store(config, lease_owner)
+        self.writer = create_session_writer(config, self.store)
+        if lease_owner and not self.store.supports_leases:
+            raise ValueError(f"Session store '{config.session_store}' cannot be shared, use SESSION_STORE = sqlite")
+
+        self._journal_lengths: Dict[str, int] = {}
+        self._archives: Dict[str, HistoryArchive] = {}
+        self._leases: Set[str] = set()
 
     def recreate(self, session_id: str) -> History:
+        self.acquire(session_id)
         self.remove_cache(session_id)
         return self.create_cache(session_id)
 
     def get(self, session_id: str) -> History:
+        self.acquire(session_id)
         cache = self.load_cache(session_id)
         if cache:
             return cache
         else:
             return self.create_cache(session_id)
 
-    def get_all(self) -> Iterable[History]:
-        for cache_path in self._get_caches_path():
-            conversation_cache = conversation_parser.parse(cache_path)
-            yield History(self._default_prompt, self._prompt_model, conversation_cache)
-
     def create_cache(self, session_id: str) -> History:
-        history = copy.deepcopy(self.default_history)
-
-        session = history.conversation_model.session
-        session.id = session_id
-        session.creationTime = datetime.now().isoformat()
+        template = self._conversation_model
 
-        messages = history.conversation_model.messages
-        messages.clear()
+        session = template.session.copy(update={'id': session_id, 'creationTime': datetime.now().isoformat()})
+        conversation_model = conversation.Model.construct(session=session, settings=template.settings, messages=[])
+        history = self._create_history(conversation_model, shared_settings=True)
 
         self.save_cache(history)
         return history
 
     def load_cache(self, session_id: str) -> Optional[History]:
-        caches_path = self._get_caches_path()
-        cache_path = next((path for path in caches_path if path.stem == session_id), None)
-        if cache_path is None:
+        self.writer.flush(session_id)
+
+        data = self.store.load(session_id)
+        if data is None:
             return None
 
-        conversation_cache = conversation_parser.parse(cache_path)
-        return History(self._default_prompt, self._prompt_model, conversation_cache)
+        self._journal_lengths[session_id] = self.store.get_journal_length(session_id)
+
+        if self.config.trusted_load and self.store.trusted:
+            conversation_cache = conversation_parser.construct(data)
+        else:
+            conversation_cache = conversation_parser.parse_data(data)
+
+        archive = self.get_archive(session_id)
+        return self._create_history(conversation_cache, message_offset=archive.message_count)
+
+    async def flush(self, session_id: str) -> None:
+        """Wait in a worker thread for the queued writes of a session, such as those left from its last release."""
+        await asyncio.to_thread(self.writer.flush, session_id)
+
+    async def load_memories(self, history: History) -> None:
+        """Index the archived messages of a loaded session in a worker thread, so a long archive does not block.
+        Until then, only the messages loaded with the session can be recalled."""
+        end = history.message_offset
+        if history.memory is None or end == 0:
+            return
+
+        # Pending archive writes are flushed first, so every archived id below `end` is on disk.
+        messages = await self.read_archive(history.session.id, 0, end)
+        memory = await asyncio.to_thread(
+            history.embed_memories, (Message.construct(**message) for message in messages)
+        )
+        history.memory.prepend(memory)
+
+    def _create_history(
+            self,
+            conversation_model: conversation.Model,
+            shared_settings: bool = False,
+            message_offset: int = 0
+    ) -> History:
+        memory = None
+        if self.embedder is not None:
+            memory = VectorMemory(self.embedder, self.config.memory_top_k, self.config.memory_min_score)
+
+        return History(
+            self._default_prompt,
+            self._prompt_model,
+            conversation_model,
+            shared_settings,
+            self._templates,
+            self.tokenizer,
+            memory,
+            message_offset
+        )
+
+    def acquire(self, session_id: str) -> None:
+        if not self.lease_owner or session_id in self._leases:
+            return
+
+        if not self.store.acquire_lease(session_id, self.lease_owner, self.config.lease_ttl, self.previous_owner):
+            raise SessionLeaseError(session_id)
+
+        self._leases.add(session_id)
+
+    def renew_leases(self) -> Set[str]:
+        """Extend the leases of every loaded session and return those that were lost to another process."""
+        if not self.lease_owner:
+            return set()
+
+        held = self.store.renew_leases(self.lease_owner, self.config.lease_ttl, self._leases)
+        lost = self._leases - held
+        self._leases &= held
+
+        for session_id in lost:
+            # The store refuses them anyway; dropping them keeps the queue from retrying stale writes.
+            self.writer.discard(session_id)
+            self._journal_lengths.pop(session_id, None)
+            self._archives.pop(session_id, None)
+
+        return lost
+
+    def _check_lease(self, session_id: str) -> None:
+        if self.lease_owner and session_id not in self._leases:
+            raise SessionLeaseError(session_id)
 
     def save_cache(self, history: History) -> None:
         session = history.conversation_model.session
-        path = self._get_cache_path(session.id)
+        self._check_lease(session.id)
+
+        with phase('persist'):
+            self.writer.save(session.id, history.conversation_model.dict())
+        self._journal_lengths[session.id] = 0
+
+    def save_records(self, history: History, records: List[Record]) -> None:
+        if not self.config.journal:
+            self.save_cache(history)
+            return
+
+        session = history.conversation_model.session
+        self._check_lease(session.id)
+        journal_length = self._journal_lengths.get(session.id, 0) + len(records)
+
+        if journal_length >= self.config.journal_compact_threshold:
+            self.save_cache(history)
+        else:
+            with phase('persist'):
+                self.writer.append_records(session.id, records)
+            self._journal_lengths[session.id] = journal_length
+
+    def get_archive(self, session_id: str) -> HistoryArchive:
+        archive = self._archives.get(session_id)
+        if archive is None:
+            self.writer.flush(session_id)
+
+            archive = HistoryArchive(
+                self.config.archive_path / session_id, self.config.archive_segment_size, self.config.fsync
+            )
+            self._archives[session_id] = archive
 
-        save_yaml(path, history.conversation_model.dict())
+        return archive
+
+    def archive_messages(self, history: History, messages: List[Message]) -> None:
+        if not messages:
+            return
+
+        self._check_lease(history.session.id)
+        archive = self.get_archive(history.session.id)
+        chunks = archive.prepare_append(messages)
+        segments = archive.get_segments()
+
+        self.writer.submit(
+            history.session.id, lambda: self._write_archive(history.session.id, archive, chunks, segments)
+        )
+
+    def _write_archive(
+            self,
+            session_id: str,
+            archive: HistoryArchive,
+            chunks: List[Tuple[int, bytes]],
+            segments: List[Segment]
+    ) -> None:
+        # Archive files are not in the store, so the lease is checked again right before they are written.
+        if self.lease_owner and not self.store.holds_lease(session_id, self.lease_owner):
+            logging.warning(f"[Archive] Dropping archived messages of session '{session_id}', its lease was lost.")
+            return
+
+        archive.write(chunks, segments)
+
+    async def read_archive(self, session_id: str, start: int = 0, end: Optional[int] = None) -> Iterator[Dict]:
+        archive = self.get_archive(session_id)
+        await self.flush(session_id)
+
+        return archive.read(start, end)
+
+    def release(self, session_id: str) -> None:
+        if session_id in self._leases:
+            # Another process may take the session as soon as the lease is gone.
+            self.writer.flush(session_id)
+            self.store.release_lease(session_id, self.lease_owner)
+            self._leases.discard(session_id)
+        else:
+            self.writer.expedite(session_id)
+
+        self._journal_lengths.pop(session_id, None)
+        self._archives.pop(session_id, None)
 
     def remove_cache(self, session_id: str) -> None:
-        remove_file(self._get_cache_path(session_id))
+        self.writer.remove(session_id)
+        self._journal_lengths.pop(session_id, None)
+
+        archive = self.get_archive(session_id)
+        archive.clear()
+        self.writer.submit(session_id, archive.remove_files)
 
     def remove_caches(self) -> None:
-        remove_file(self.config.cache_path)
+        self.writer.flush()
+        self.store.clear()
+        self._journal_lengths.clear()
 
-    def _get_caches_path(self) -> Iterable[Path]:
-        return Path(self.config.cache_path).glob('*.yaml')
+    def close(self) -> None:
+        self.writer.close()
+        for session_id in self._leases:
+            self.store.release_lease(session_id, self.lease_owner)
 
-    def _get_cache_path(self, session_id: str) -> Path:
-        return self.config.cache_path / f'{session_id}.yaml'
+        self._leases.clear()
+        self.store.close()
@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import discord
+from discord import app_commands, Object
+
+from utils.file_io import load_json, save_json
+
+
+class CommandSync:
+    """Syncs the command tree only to guilds whose commands changed since the last sync.
+
+    The fingerprint of a guild is a hash of the payload `CommandTree.sync` would upload, so it covers names,
+    descriptions, parameters and the choices built from the prompt model. Fingerprints are kept in `path`,
+    and deleting it forces every guild to be synced again."""
+
+    def __init__(self, tree: app_commands.CommandTree, path: Path, concurrency: int) -> None:
+        self.tree = tree
+        self.path = path
+        self.concurrency = max(concurrency, 1)
+
+    def get_fingerprint(self, guild: Object) -> str:
+        payload = [command.to_dict() for command in self.tree.get_commands(guild=guild)]
+        data = json.dumps([self.tree.client.application_id, payload], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    async def sync(self, guilds: Sequence[Object]) -> List[Object]:
+        """Sync the guilds whose fingerprint changed, at most `concurrency` at a time, and return them."""
+        fingerprints: Dict[str, str] = load_json(self.path)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        changed = []
+        for guild in guilds:
+            fingerprint = self.get_fingerprint(guild)
+            if fingerprints.get(str(guild.id)) == fingerprint:
+                logging.info(f"[Event] Commands in '{guild.id}' are up to date.")
+            else:
+                changed.append((guild, fingerprint))
+
+        async def sync_guild(guild: Object, fingerprint: str) -> bool:
+            async with semaphore:
+                try:
+                    logging.info(f"[Event] Syncing commands in '{guild.id}'...")
+                    await self.tree.sync(guild=guild)
+                except discord.errors.Forbidden:
+                    logging.info(f"[Event] Failed to sync commands in '{guild.id}' due to insufficient permissions.")
+                    return False
+
+            fingerprints[str(guild.id)] = fingerprint
+            return True
+
+        results = await asyncio.gather(
+            *(sync_guild(guild, fingerprint) for guild, fingerprint in changed), return_exceptions=True
+        )
+
+        synced = []
+        for (guild, _), result in zip(changed, results):
+            if isinstance(result, BaseException):
+                logging.error(f"[Event] Failed to sync commands in '{guild.id}'.", exc_info=result)
+            elif result:
+                synced.append(guild)
+
+        if synced:
+            save_json(self.path, fingerprints)
+
+        return synced
@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import List, AsyncIterator, Optional
+
+import aiohttp
+import openai
+
+from scripts.config import AppConfig
+from scripts.instrumentation import record_completion
+
+
+@dataclass
+class CompletionRequest:
+    engine: str
+    prompt: str
+    max_tokens: int
+    temperature: float = 0.0
+    top_p: float = 1.0
+    frequency_penalty: float = 0.0
+    presence_penalty: float = 0.0
+    stop: List[str] = field(default_factory=list)
+    session_id: str = ''
+    prompt_tokens: int = 0
+    n: int = 1
+
+
+class CompletionBackend(ABC):
+    """Text completion service used by conversations and background jobs."""
+
+    @abstractmethod
+    async def complete(self, request: CompletionRequest) -> str:
+        ...
+
+    async def complete_many(self, request: CompletionRequest) -> List[str]:
+        """`request.n` alternative completions of the same prompt."""
+        return list(await asyncio.gather(*(self.complete(request) for _ in range(request.n))))
+
+    async def complete_batch(self, requests: List[CompletionRequest]) -> List[List[str]]:
+        """Completions of several prompts that share every sampling parameter, in request order."""
+        return list(await asyncio.gather(*(self.complete_many(request) for request in requests)))
+
+    async def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        """Yield the completion in pieces as they arrive. Backends without streaming yield it whole."""
+        yield await self.complete(request)
+
+    async def close(self) -> None:
+        pass
+
+
+class OpenAiBackend(CompletionBackend):
+    """OpenAI completions over one pooled HTTP session, rotating through the configured credentials per request."""
+
+    def __init__(self, config: AppConfig) -> None:
+        self.config = config
+
+        keys = config.open_ai_api_keys or ['']
+        organizations = config.open_ai_organization_ids or ['']
+        if len(organizations) == 1:
+            organizations = organizations * len(keys)
+        elif len(organizations) != len(keys):
+            raise ValueError("OPEN_AI_ORGANIZATION_ID needs one entry, or one per OPEN_AI_API_KEY")
+
+        self._credentials = itertools.cycle(list(zip(keys, organizations)))
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def complete(self, request: CompletionRequest) -> str:
+        response = await self._request(request)
+        return response.choices[0].text
+
+    async def complete_many(self, request: CompletionRequest) -> List[str]:
+        response = await self._request(request)
+        return [choice.text for choice in sorted(response.choices, key=lambda choice: choice.index)]
+
+    async def complete_batch(self, requests: List[CompletionRequest]) -> List[List[str]]:
+        # Choices of prompt i are numbered from i * n.
+        n = requests[0].n
+        response = await self._request(requests[0], [request.prompt for request in requests])
+        texts = [[''] * n for _ in requests]
+        for choice in response.choices:
+            texts[choice.index // n][choice.index % n] = choice.text
+
+        return texts
+
+    async def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        # Streams report no usage; each chunk carries about one token.
+        start = time.perf_counter()
+        chunks = 0
+        try:
+            async for chunk in await self._create(request, stream=True):
+                chunks += 1
+                yield chunk.choices[0].text
+        except Exception as e:
+            record_completion(request.engine, time.perf_counter() - start, type(e).__name__, 0, 0)
+            raise
+
+        record_completion(request.engine, time.perf_counter() - start, 'ok', request.prompt_tokens, chunks)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, request: CompletionRequest, prompt: Optional[List[str]] = None):
+        start = time.perf_counter()
+        try:
+            response = await self._create(request, prompt=prompt)
+        except Exception as e:
+            record_completion(request.engine, time.perf_counter() - start, type(e).__name__, 0, 0)
+            raise
+
+        usage = response.get('usage') or {}
+        record_completion(
+            request.engine,
+            time.perf_counter() - start,
+            'ok',
+            usage.get('prompt_tokens', 0),
+            usage.get('completion_tokens', 0)
+        )
+        return response
+
+    async def _create(self, request: CompletionRequest, stream: bool = False, prompt: Optional[List[str]] = None):
+        api_key, organization = next(self._credentials)
+
+        # openai reads the session from a context variable; setting it here only affects this call.
+        token = openai.aiosession.set(self._get_session())
+        try:
+            return await openai.Completion.acreate(
+                engine=request.engine,
+                prompt=request.prompt if prompt is None else prompt,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens,
+                top_p=request.top_p,
+                frequency_penalty=request.frequency_penalty,
+                presence_penalty=request.presence_penalty,
+                stop=request.stop or None,
+                n=request.n,
+                stream=stream,
+                api_key=api_key or None,
+                organization=organization or None,
+                api_base=self.config.open_ai_api_base or None,
+                request_timeout=(self.config.connect_timeout, self.config.request_timeout),
+            )
+        finally:
+            openai.aiosession.reset(token)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config.pool_size,
+                keepalive_timeout=self.config.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+
+        return self._session
@@ -1,5 +1,6 @@
-from configparser import ConfigParser
+from configparser import ConfigParser, SectionProxy, DEFAULTSECT
 from pathlib import Path
+from typing import List
 
 
 class AppConfig:
@@ -14,6 +15,20 @@ class AppConfig:
         self._environment = self._config['Environment']
         self._tokens = self._config['Tokens']
         self._servers = self._config['Servers']
+        self._storage = self._get_section('Storage')
+        self._sessions = self._get_section('Sessions')
+        self._completion = self._get_section('Completion')
+        self._memory = self._get_section('Memory')
+        self._metrics = self._get_section('Metrics')
+        self._sharding = self._get_section('Sharding')
+        self._commands = self._get_section('Commands')
+
+    def _get_section(self, name: str) -> SectionProxy:
+        return self._config[name] if self._config.has_section(name) else self._config[DEFAULTSECT]
+
+    @staticmethod
+    def _get_list(section: SectionProxy, key: str) -> List[str]:
+        return [value.strip() for value in section.get(key, '').split(',') if value.strip()]
 
     def _init_values(self) -> None:
         # [Environment]
@@ -23,9 +38,76 @@ class AppConfig:
         self.cache_path = Path(self._environment.get('CACHE_PATH', ''))
 
         # [Tokens]
-        self.open_ai_organization_id = self._tokens.get('OPEN_AI_ORGANIZATION_ID', '')
-        self.open_ai_api_key = self._tokens.get('OPEN_AI_API_KEY', '')
+        self.open_ai_organization_ids = self._get_list(self._tokens, 'OPEN_AI_ORGANIZATION_ID')
+        self.open_ai_api_keys = self._get_list(self._tokens, 'OPEN_AI_API_KEY')
         self.discord_bot_token = self._tokens.get('DISCORD_BOT_TOKEN', '')
 
         # [Servers]
         self.server_guilds = self._servers.values()
+
+        # [Storage]
+        self.session_store = self._storage.get('SESSION_STORE', 'yaml').lower()
+        self.session_format = self._storage.get('SESSION_FORMAT', 'yaml').lower()
+        self.trusted_load = self._storage.getboolean('TRUSTED_LOAD', False)
+        self.session_db_path = Path(self._storage.get('SESSION_DB_PATH', './.cache/sessions.db'))
+        self.import_yaml_cache = self._storage.getboolean('IMPORT_YAML_CACHE', True)
+        self.journal = self._storage.getboolean('JOURNAL', False)
+        self.journal_compact_threshold = self._storage.getint('JOURNAL_COMPACT_THRESHOLD', 200)
+        self.fsync = self._storage.getboolean('FSYNC', False)
+        self.write_behind = self._storage.getboolean('WRITE_BEHIND', False)
+        self.write_behind_delay = self._storage.getfloat('WRITE_BEHIND_DELAY', 1.0)
+        self.archive_path = Path(self._storage.get('ARCHIVE_PATH', './.archive/'))
+        self.archive_segment_size = self._storage.getint('ARCHIVE_SEGMENT_SIZE', 1000)
+
+        # [Sessions]
+        self.max_resident_sessions = self._sessions.getint('MAX_RESIDENT_SESSIONS', 0)
+        self.session_memory_budget = self._sessions.getint('SESSION_MEMORY_BUDGET_KB', 0) * 1024
+        self.session_idle_timeout = self._sessions.getfloat('SESSION_IDLE_TIMEOUT', 0)
+        self.session_sweep_interval = self._sessions.getfloat('SESSION_SWEEP_INTERVAL', 60)
+
+        # [Completion]
+        self.open_ai_api_base = self._completion.get('OPEN_AI_API_BASE', '')
+        self.pool_size = self._completion.getint('POOL_SIZE', 32)
+        self.keepalive_timeout = self._completion.getfloat('KEEPALIVE_TIMEOUT', 60)
+        self.connect_timeout = self._completion.getfloat('CONNECT_TIMEOUT', 10)
+        self.request_timeout = self._completion.getfloat('REQUEST_TIMEOUT', 120)
+        self.requests_per_minute = self._completion.getint('REQUESTS_PER_MINUTE', 0)
+        self.tokens_per_minute = self._completion.getint('TOKENS_PER_MINUTE', 0)
+        self.max_concurrent_requests = self._completion.getint('MAX_CONCURRENT_REQUESTS', 0)
+        self.max_retries = self._completion.getint('MAX_RETRIES', 4)
+        self.retry_base_delay = self._completion.getfloat('RETRY_BASE_DELAY', 0.5)
+        self.retry_max_delay = self._completion.getfloat('RETRY_MAX_DELAY', 20)
+        self.breaker_failure_threshold = self._completion.getint('BREAKER_FAILURE_THRESHOLD', 5)
+        self.breaker_reset_timeout = self._completion.getfloat('BREAKER_RESET_TIMEOUT', 30)
+        self.tokenizer = self._completion.get('TOKENIZER', 'approximate').lower()
+        self.token_margin = self._completion.getint('TOKEN_MARGIN', 16)
+        self.streaming = self._completion.getboolean('STREAMING', False)
+        self.stream_edit_interval = self._completion.getfloat('STREAM_EDIT_INTERVAL', 1.0)
+        self.summary_enabled = self._completion.getboolean('SUMMARY_ENABLED', False)
+        self.summary_max_tokens = self._completion.getint('SUMMARY_MAX_TOKENS', 256)
+        self.summary_chunk_tokens = self._completion.getint('SUMMARY_CHUNK_TOKENS', 1500)
+        self.reroll_candidates = self._completion.getint('REROLL_CANDIDATES', 1)
+        self.batch_enabled = self._completion.getboolean('BATCH_ENABLED', False)
+        self.batch_window = self._completion.getfloat('BATCH_WINDOW', 0.01)
+        self.batch_max_size = self._completion.getint('BATCH_MAX_SIZE', 16)
+
+        # [Memory]
+        self.memory_enabled = self._memory.getboolean('MEMORY_ENABLED', False)
+        self.embedder = self._memory.get('EMBEDDER', 'hashing').lower()
+        self.embedding_dimension = self._memory.getint('EMBEDDING_DIMENSION', 256)
+        self.memory_top_k = self._memory.getint('MEMORY_TOP_K', 4)
+        self.memory_min_score = self._memory.getfloat('MEMORY_MIN_SCORE', 0.2)
+
+        # [Metrics]
+        self.metrics_enabled = self._metrics.getboolean('METRICS_ENABLED', False)
+        self.metrics_host = self._metrics.get('METRICS_HOST', '127.0.0.1')
+        self.metrics_port = self._metrics.getint('METRICS_PORT', 9108)
+
+        # [Sharding]
+        self.shard_count = self._sharding.getint('SHARD_COUNT', 1)
+        self.lease_ttl = self._sharding.getfloat('LEASE_TTL', 30)
+        self.lease_renew_interval = self._sharding.getfloat('LEASE_RENEW_INTERVAL', 10)
+
+        # [Commands]
+        self.command_sync_path = Path(self._commands.get('COMMAND_SYNC_PATH', './.state/command_sync.json'))
+        self.command_sync_concurrency = self._commands.getint('COMMAND_SYNC_CONCURRENCY', 4)
@@ -1,14 +1,26 @@
+import asyncio
 import copy
+import gzip
+import logging
 import re
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Callable, Awaitable, List, Sequence, BinaryIO, AsyncIterator
 
 import openai
 
 from data.conversation import Message
 from data.history import History
 from scripts.cache_manager import CacheManager
+from scripts.completion import CompletionBackend, CompletionRequest
 from scripts.config import AppConfig
+from scripts.instrumentation import phase
+from scripts.reroll_buffer import RerollBuffer
+from scripts.session_journal import (
+    Record, append_record, set_record, truncate_record, drop_record, settings_record, summary_record
+)
+from scripts.summarizer import Summarizer
+from utils.pagination import Page, get_page_after, get_page_before
 
 TEMPERATURE_MAP = {
     "로봇": 0.0,
@@ -20,15 +32,50 @@ TEMPERATURE_MAP = {
     "헛소리": 1.5,
 }
 
+CONTEXT_LENGTH_MAP = {
+    "text-davinci-003": 4097,
+    "text-davinci-002": 4097,
+    "code-davinci-002": 8001,
+    "text-curie-001": 2049,
+    "text-babbage-001": 2049,
+    "text-ada-001": 2049,
+}
+
+DEFAULT_CONTEXT_LENGTH = 2049
+
+# Discord's limit on the length of a message.
+PAGE_LIMIT = 2000
+
+Prediction = Tuple[List[Message], Message]
+PartialCallback = Callable[[str], Awaitable[None]]
+PredictionCallback = Callable[[List[Message], Message], Awaitable[None]]
+
+
+class _SendBatch:
+    """Questions sent while the session was busy, answered together by the first sender.
+    The others wait on `done` to learn whether their questions were answered."""
+
+    def __init__(self, question: Message) -> None:
+        self.questions = [question]
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+
 
 class Conversation:
-    def __init__(self, config: AppConfig, cache_manager: CacheManager, cache: History) -> None:
+    def __init__(
+            self,
+            config: AppConfig,
+            cache_manager: CacheManager,
+            cache: History,
+            backend: CompletionBackend,
+            summarizer: Optional[Summarizer] = None,
+            rerolls: Optional[RerollBuffer] = None
+    ) -> None:
         self.config = config
         self.cache_manager = cache_manager
         self.cache = cache
-
-        openai.organization = config.open_ai_organization_id
-        openai.api_key = config.open_ai_api_key
+        self.backend = backend
+        self.summarizer = summarizer
+        self.rerolls = rerolls
 
         self.scroll_amount = cache.settings.scrollAmount
         self.engine_name = cache.settings.engineName
@@ -37,9 +84,35 @@ class Conversation:
         self.frequency_penalty = cache.settings.frequencyPenalty
         self.presence_penalty = cache.settings.presencePenalty
 
+        # Every command that touches the session runs under this lock, in arrival order.
+        self._lock = asyncio.Lock()
+        self._pending_batch: Optional[_SendBatch] = None
+
+    @asynccontextmanager
+    async def _exclusive(self, keep_rerolls: bool = False) -> AsyncIterator[None]:
+        """Hold the lock for a command other than `send`. Later sends must not join a batch queued before it,
+        or they would overtake it. Buffered rerolls answer the history as it was, so a command that may change it
+        drops them, while `retry`, which consumes them, keeps them."""
+        self._pending_batch = None
+        async with self._lock:
+            if not keep_rerolls:
+                self.discard_rerolls()
+
+            yield
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked() or self._pending_batch is not None
+
     def _save_cache(self) -> None:
         self.cache_manager.save_cache(self.cache)
 
+    def _save_records(self, *records: Record) -> None:
+        self.cache_manager.save_records(self.cache, list(records))
+
+    def _save_settings(self) -> None:
+        self._save_records(settings_record(self.cache.settings))
+
     @property
     def user_name(self) -> str:
         return self.cache.get_sender_name('user')
@@ -50,13 +123,13 @@ class Conversation:
 
     @user_name.setter
     def user_name(self, value: str) -> None:
-        self.cache.participants[0].name = value
-        self._save_cache()
+        self.cache.edit_settings().participants[0].name = value
+        self._save_settings()
 
     @ai_name.setter
     def ai_name(self, value: str) -> None:
-        self.cache.participants[1].name = value
-        self._save_cache()
+        self.cache.edit_settings().participants[1].name = value
+        self._save_settings()
 
     @property
     def prompt(self) -> str:
@@ -70,31 +143,143 @@ class Conversation:
 
         return 0
 
-    async def _predict(self) -> str:
+    @property
+    def context_length(self) -> int:
+        return CONTEXT_LENGTH_MAP.get(self.engine_name, DEFAULT_CONTEXT_LENGTH)
+
+    def _get_message_budget(self) -> int:
+        prompt_tokens = self.cache.count_prompt_tokens() + self.cache.count_memory_tokens()
+        prompt_tokens = self.cache.tokenizer.estimate(prompt_tokens)
+        return self.context_length - self.max_tokens - prompt_tokens - self.config.token_margin
+
+    def _fit_history(self) -> bool:
+        """Scroll out just enough old messages for the prompt to fit the context, keeping the last exchange."""
+        cut = self.cache.find_cut_index(self._get_message_budget())
+        cut = min(cut, max(len(self.cache.messages) - 2, 0))
+        if cut <= 0:
+            return False
+
+        self._scroll_history(cut)
+        return True
+
+    async def _predict(self, on_partial: Optional[PartialCallback] = None, reroll: bool = False) -> str:
+        """`reroll` serves a spare candidate of the same prompt when one is buffered."""
+        self._fit_history()
+
+        prompt = self.prompt
+        key = RerollBuffer.get_key(prompt) if self.rerolls is not None else ''
+        if reroll and self.rerolls is not None:
+            text = await self.rerolls.take(self.cache.session.id, key)
+            if text is not None:
+                return text.strip()
+
+        request = CompletionRequest(
+            engine=self.engine_name,
+            prompt=prompt,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            top_p=self.top_p,
+            frequency_penalty=self.frequency_penalty,
+            presence_penalty=self.presence_penalty,
+            stop=[f'{self.user_name}:', f'{self.ai_name}:'],
+            session_id=self.cache.session.id,
+        )
+        counted_tokens = self.cache.count_prompt_history_tokens()
+        request.prompt_tokens = self.cache.tokenizer.estimate(counted_tokens)
+        spares = []
         try:
-            response = await openai.Completion.acreate(
-                engine=self.engine_name,
-                prompt=self.prompt,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                top_p=self.top_p,
-                frequency_penalty=self.frequency_penalty,
-                presence_penalty=self.presence_penalty,
-                stop=[f'{self.user_name}:', f'{self.ai_name}:'],
-            )
+            with phase('model'):
+                if on_partial is not None and self.config.streaming:
+                    text = await self._stream(request, on_partial)
+                elif self.rerolls is not None:
+                    request.n = self.rerolls.candidates
+                    text, *spares = await self.backend.complete_many(request)
+                else:
+                    text = await self.backend.complete(request)
         except openai.error.InvalidRequestError as e:
             if e.user_message.startswith("This model's maximum context length is"):
-                self._scroll_history()
-                return await self._predict()
+                self._calibrate_tokens(e.user_message, counted_tokens)
+                if not self._fit_history():
+                    if not self.cache.messages:
+                        raise e
+
+                    self._scroll_history()
+
+                return await self._predict(on_partial, reroll)
 
             raise e
 
-        return response.choices[0].text.strip()
+        if self.rerolls is not None:
+            self.rerolls.put(request, key, spares)
+
+        return text.strip()
+
+    async def _stream(self, request: CompletionRequest, on_partial: PartialCallback) -> str:
+        pieces = []
+        async for piece in self.backend.stream(request):
+            pieces.append(piece)
+            await on_partial(''.join(pieces).strip())
+
+        return ''.join(pieces)
+
+    @staticmethod
+    def _bind_partial(
+            questions: List[Message],
+            on_partial: Optional[PredictionCallback]
+    ) -> Optional[PartialCallback]:
+        if on_partial is None:
+            return None
+
+        async def on_text(text: str) -> None:
+            await on_partial(questions, Message.construct(sender='ai', text=text, timestamp=''))
+
+        return on_text
 
-    def _scroll_history(self) -> None:
+    def _scroll_history(self, count: Optional[int] = None) -> None:
         print('[Conversation] Scrolling history...')
-        self.cache.messages = self.cache.messages[self.scroll_amount:]
-        self._save_cache()
+        scrolled = self.cache.drop_messages(self.scroll_amount if count is None else count)
+        self._save_records(drop_record(len(scrolled)))
+        self.cache_manager.archive_messages(self.cache, scrolled)
+
+        if self.summarizer is not None:
+            lines = [self.cache.format_message(message) for message in scrolled]
+            self.summarizer.submit(self.cache, lines, self._make_summary_callback())
+
+    def _make_summary_callback(self) -> Callable[[str], None]:
+        cache = self.cache
+
+        def on_summary(summary: str) -> None:
+            # The session may have been reset while the summary was being written.
+            if self.cache is cache:
+                cache.summary = summary
+                self._save_records(summary_record(summary))
+
+        return on_summary
+
+    def _cancel_summary(self) -> None:
+        if self.summarizer is not None:
+            self.summarizer.cancel(self.cache.session.id)
+
+    def discard_rerolls(self) -> None:
+        if self.rerolls is not None:
+            self.rerolls.discard(self.cache.session.id)
+
+    @property
+    def summarizing(self) -> bool:
+        return self.summarizer is not None and self.summarizer.is_pending(self.cache.session.id)
+
+    def close(self) -> None:
+        """Drop the background work of a session being released, so nothing is written for it afterwards."""
+        self._cancel_summary()
+        self.discard_rerolls()
+
+    def _calibrate_tokens(self, text: str, counted_tokens: int) -> None:
+        try:
+            _, _, prompt_tokens, _ = self._parse_tokens_from_error(text)
+        except AttributeError:
+            return
+
+        self.cache.tokenizer.calibrate(counted_tokens, prompt_tokens)
 
     @staticmethod
     def _parse_tokens_from_error(text: str) -> Tuple[int, int, int, int]:
@@ -110,141 +295,282 @@ class Conversation:
 
         return max_tokens, current_tokens, prompt_tokens, completion_tokens
 
-    def format_prediction(self, question: Message, answer: Message) -> str:
-        return f"**{self.user_name}**: {question.text}\n**{self.ai_name}**: {answer.text}"
-
-    async def send(self, message: str) -> Tuple[Message, Message]:
+    def format_prediction(self, questions: Sequence[Message], answer: Message) -> str:
+        lines = [f"**{self.user_name}**: {question.text}" for question in questions]
+        lines.append(f"**{self.ai_name}**: {answer.text}")
+        return '\n'.join(lines)
+
+    def _get_questions(self, end: int) -> List[Message]:
+        """The run of user messages right before index `end`, answered together."""
+        messages = self.cache.messages
+        start = end
+        while start > 0 and messages[start - 1].sender == 'user':
+            start -= 1
+
+        return messages[start:end]
+
+    async def send(
+            self,
+            message: str,
+            on_partial: Optional[PredictionCallback] = None,
+            on_queued: Optional[Callable[[], Awaitable[None]]] = None
+    ) -> Optional[Prediction]:
+        """Ask the model. While the session is busy, later messages join one pending batch:
+        the first sender gets every question and the answer. The others are told through `on_queued`,
+        then get None once the batch is answered, or the error if it failed."""
         question = Message(sender='user', text=message, timestamp=datetime.now().isoformat())
-        answer = Message(sender='ai', text='', timestamp='')
 
-        self.cache.messages.append(question)
-        self.cache.messages.append(answer)
-
-        answer.text = await self._predict()
-        answer.timestamp = datetime.now().isoformat()
-        self._save_cache()
-
-        return question, answer
+        batch = self._pending_batch
+        if batch is not None:
+            batch.questions.append(question)
+            if on_queued is not None:
+                await on_queued()
 
-    async def retry(self) -> Optional[Tuple[Message, Message]]:
-        if len(self.cache.messages) < 2:
+            await asyncio.shield(batch.done)
             return None
 
-        last_message = self.cache.messages[-1]
-
-        if last_message.sender != 'ai':
-            return None
-
-        last_message.text = ''
-        last_message.text = await self._predict()
-        last_message.timestamp = datetime.now().isoformat()
-
-        self._save_cache()
+        batch = self._pending_batch = _SendBatch(question)
+        try:
+            async with self._lock:
+                if self._pending_batch is batch:
+                    self._pending_batch = None
+
+                prediction = await self._send(batch.questions, on_partial)
+        except BaseException as e:
+            if self._pending_batch is batch:
+                self._pending_batch = None
+            if len(batch.questions) > 1:
+                if isinstance(e, Exception):
+                    batch.done.set_exception(e)
+                else:
+                    batch.done.cancel()
+            raise
+
+        batch.done.set_result(None)
+        return prediction
+
+    async def _send(self, questions: List[Message], on_partial: Optional[PredictionCallback]) -> Prediction:
+        if len(questions) > 1:
+            logging.info(f"[Conversation] Coalesced {len(questions)} messages into one prediction.")
 
-        return self.cache.messages[-2], last_message
+        answer = Message(sender='ai', text='', timestamp='')
 
-    def record(self, message: str) -> None:
-        prompt = Message(sender='text', text=message, timestamp=datetime.now().isoformat())
+        self.cache.messages.extend(questions)
+        self.cache.messages.append(answer)
+        self._save_records(append_record((*questions, answer)))
 
-        self.cache.messages.append(prompt)
-        self._save_cache()
+        try:
+            answer.text = await self._predict(self._bind_partial(questions, on_partial))
+        except Exception:
+            # Take the unanswered exchange back, so a failed call leaves no empty answer behind.
+            start = max(len(self.cache.messages) - len(questions) - 1, 0)
+            del self.cache.messages[start:]
+            self.cache.invalidate_messages(start)
+            self._save_records(truncate_record(start))
+            raise
 
-    def replace(self, before: str, after: str) -> None:
-        for message in self.cache.messages:
-            message.text = message.text.replace(before, after)
+        answer.timestamp = datetime.now().isoformat()
+        self.cache.invalidate_messages(-1)
+        self._save_records(set_record(-1, answer))
 
-        self._save_cache()
+        return questions, answer
 
-    def modify(self, message: str) -> Optional[Tuple[Message, Message]]:
-        if len(self.cache.messages) < 1:
-            return None
+    async def retry(
+            self,
+            on_partial: Optional[PredictionCallback] = None,
+            timestamp: Optional[str] = None
+    ) -> Optional[Prediction]:
+        """Answer the last questions again. With `timestamp`, only if the last answer is still that one."""
+        async with self._exclusive(keep_rerolls=True):
+            if len(self.cache.messages) < 2:
+                return None
 
-        last_message = self.cache.messages[-1]
-        last_message_copy = copy.deepcopy(last_message)
+            last_message = self.cache.messages[-1]
 
-        last_message.text = message
-        self._save_cache()
-        return last_message_copy, last_message
+            if last_message.sender != 'ai':
+                return None
+            if timestamp is not None and last_message.timestamp != timestamp:
+                return None
 
-    def rename(self, user: str, ai: str) -> None:
-        for message in self.cache.messages:
-            message.text = message.text.replace(self.user_name, user)
-            message.text = message.text.replace(self.ai_name, ai)
+            questions = self._get_questions(len(self.cache.messages) - 1)
 
-        self.cache.participants[0].name = user
-        self.cache.participants[1].name = ai
+            previous_text = last_message.text
+            last_message.text = ''
+            self.cache.invalidate_messages(-1)
+            try:
+                last_message.text = await self._predict(self._bind_partial(questions, on_partial), reroll=True)
+            except Exception:
+                last_message.text = previous_text
+                self.cache.invalidate_messages(len(self.cache.messages) - 1)
+                raise
 
-        self._save_cache()
+            last_message.timestamp = datetime.now().isoformat()
+            self.cache.invalidate_messages(-1)
 
-    def swap(self) -> None:
-        prev_user = self.user_name
-        prev_ai = self.ai_name
+            self._save_records(set_record(-1, last_message))
 
-        for message in self.cache.messages:
-            message.text = message.text.replace(prev_user, '{temp}')
-            message.text = message.text.replace(prev_ai, prev_user)
-            message.text = message.text.replace('{temp}', prev_ai)
+            return questions, last_message
 
-        self.cache.participants[0].name = prev_ai
-        self.cache.participants[1].name = prev_user
+    async def record(self, message: str) -> None:
+        async with self._exclusive():
+            prompt = Message(sender='text', text=message, timestamp=datetime.now().isoformat())
 
-        self._save_cache()
+            self.cache.messages.append(prompt)
+            self._save_records(append_record((prompt,)))
 
-    def undo(self) -> str:
-        if len(self.cache.messages) == 0:
-            return ''
+    async def replace(self, before: str, after: str) -> None:
+        async with self._exclusive():
+            for message in self.cache.messages:
+                message.text = message.text.replace(before, after)
 
-        last_message = self.cache.messages[-1]
+            self.cache.invalidate_messages()
+            self._save_cache()
 
-        if last_message.sender == 'user':
-            return ''
+    async def modify(self, message: str) -> Optional[Tuple[Message, Message]]:
+        async with self._exclusive():
+            if len(self.cache.messages) < 1:
+                return None
 
-        elif last_message.sender == 'text':
-            self.cache.messages = self.cache.messages[:-1]
-            self._save_cache()
-            return f'~~({last_message.text})~~'
+            last_message = self.cache.messages[-1]
+            last_message_copy = copy.deepcopy(last_message)
 
-        elif last_message.sender == 'ai':
-            last_user_message = self.cache.messages[-2]
-            self.cache.messages = self.cache.messages[:-2]
-            self._save_cache()
-            return f"~~{self.format_prediction(last_user_message, last_message)}~~"
+            last_message.text = message
+            self.cache.invalidate_messages(-1)
+            self._save_records(set_record(-1, last_message))
+            return last_message_copy, last_message
 
-    def clear(self) -> None:
-        self.cache.messages.clear()
-        self._save_cache()
+    async def rename(self, user: str, ai: str) -> None:
+        async with self._exclusive():
+            for message in self.cache.messages:
+                message.text = message.text.replace(self.user_name, user)
+                message.text = message.text.replace(self.ai_name, ai)
 
-    def reset(self) -> None:
-        session_id = self.cache.session.id
-        self.cache = self.cache_manager.recreate(session_id)
+            self.cache.invalidate_messages()
 
-    def print(self) -> str:
-        return self.cache.get_full_messages()
+            participants = self.cache.edit_settings().participants
+            participants[0].name = user
+            participants[1].name = ai
 
-    def debug(self) -> str:
-        return self.cache.get_prompt_history()
+            self._save_cache()
 
-    def change_creativity(self, creativity: str) -> None:
-        for trait in self.cache.settings.traits:
-            if trait.category == 'creativity':
-                trait.style = creativity
-                break
+    async def swap(self) -> None:
+        async with self._exclusive():
+            prev_user = self.user_name
+            prev_ai = self.ai_name
 
-        self._save_cache()
+            for message in self.cache.messages:
+                message.text = message.text.replace(prev_user, '{temp}')
+                message.text = message.text.replace(prev_ai, prev_user)
+                message.text = message.text.replace('{temp}', prev_ai)
 
-    def change_characteristic(self, characteristic: str) -> None:
-        for trait in self.cache.settings.traits:
-            if trait.category == 'characteristic':
-                trait.style = characteristic
-                break
+            self.cache.invalidate_messages()
 
-        self._save_cache()
+            participants = self.cache.edit_settings().participants
+            participants[0].name = prev_ai
+            participants[1].name = prev_user
 
-    def change_relationship(self, relationship: str) -> None:
-        for trait in self.cache.settings.traits:
-            if trait.category == 'relationship':
-                trait.style = relationship
-                break
+            self._save_cache()
 
-        self._save_cache()
+    async def undo(self) -> str:
+        async with self._exclusive():
+            if len(self.cache.messages) == 0:
+                return ''
+
+            last_message = self.cache.messages[-1]
+
+            if last_message.sender == 'user':
+                return ''
+
+            elif last_message.sender == 'text':
+                del self.cache.messages[-1:]
+                self.cache.invalidate_messages(-1)
+                self._save_records(truncate_record(len(self.cache.messages)))
+                return f'~~({last_message.text})~~'
+
+            elif last_message.sender == 'ai':
+                questions = self._get_questions(len(self.cache.messages) - 1) or self.cache.messages[-2:-1]
+                count = len(questions) + 1
+                del self.cache.messages[-count:]
+                self.cache.invalidate_messages(-count)
+                self._save_records(truncate_record(len(self.cache.messages)))
+                return f"~~{self.format_prediction(questions, last_message)}~~"
+
+    async def clear(self) -> None:
+        async with self._exclusive():
+            self._cancel_summary()
+            self.cache.messages.clear()
+            self.cache.invalidate_messages()
+            self.cache.summary = ''
+            self._save_records(truncate_record(0), summary_record(''))
+
+    async def reset(self) -> None:
+        async with self._exclusive():
+            self._cancel_summary()
+            session_id = self.cache.session.id
+            self.cache = self.cache_manager.recreate(session_id)
+
+    def print(self, start: Optional[int] = None, end: Optional[int] = None) -> Page:
+        return self._get_page(False, start, end)
+
+    def debug(self, start: Optional[int] = None, end: Optional[int] = None) -> Page:
+        return self._get_page(True, start, end)
+
+    def _get_page(self, debug: bool, start: Optional[int], end: Optional[int]) -> Page:
+        """The page from `start` or up to `end`, the last one by default.
+
+        Positions count from the first archived message, so a page stays put while older messages scroll out."""
+        cache = self.cache
+        lines = cache.get_page_lines(debug)
+        base = cache.message_offset - (len(lines) - len(cache.messages))
+
+        if start is not None:
+            page = get_page_after(lines, start - base, PAGE_LIMIT)
+        else:
+            page = get_page_before(lines, len(lines) if end is None else end - base, PAGE_LIMIT)
+
+        return page.shift(base)
+
+    async def export(self, file: BinaryIO) -> None:
+        """Write the whole history, archived messages included, to `file` as gzip-compressed text.
+
+        Messages are streamed from the archive, so memory use does not grow with the length of the session."""
+        cache = self.cache
+        archive = await self.cache_manager.read_archive(cache.session.id, 0, cache.message_offset)
+        lines = list(cache.get_message_lines())
+
+        def write() -> None:
+            with gzip.GzipFile(fileobj=file, mode='wb') as f:
+                for message in archive:
+                    f.write(f"{cache.format_message(Message.construct(**message))}\n".encode('utf-8'))
+                for line in lines:
+                    f.write(f"{line}\n".encode('utf-8'))
+
+        await asyncio.to_thread(write)
+
+    async def change_creativity(self, creativity: str) -> None:
+        async with self._exclusive():
+            for trait in self.cache.edit_settings().traits:
+                if trait.category == 'creativity':
+                    trait.style = creativity
+                    break
+
+            self._save_settings()
+
+    async def change_characteristic(self, characteristic: str) -> None:
+        async with self._exclusive():
+            for trait in self.cache.edit_settings().traits:
+                if trait.category == 'characteristic':
+                    trait.style = characteristic
+                    break
+
+            self._save_settings()
+
+    async def change_relationship(self, relationship: str) -> None:
+        async with self._exclusive():
+            for trait in self.cache.edit_settings().traits:
+                if trait.category == 'relationship':
+                    trait.style = relationship
+                    break
+
+            self._save_settings()
 
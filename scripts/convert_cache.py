@@ -0,0 +1,88 @@
+import argparse
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+from data import conversation_parser
+from scripts.config import AppConfig
+from scripts.session_store import FileSessionStore, SqliteSessionStore, SessionStore, validate
+from utils.serialization import SERIALIZERS, get_serializer, msgpack
+
+
+def convert(source: SessionStore, target: SessionStore) -> int:
+    return target.import_from(source, validate)
+
+
+def benchmark(message_count: int, repeat: int) -> None:
+    data = create_sample(message_count)
+
+    print(f"[Benchmark] {message_count} messages, best of {repeat}")
+    for serializer in SERIALIZERS.values():
+        if serializer.name == 'msgpack' and msgpack is None:
+            continue
+
+        blob = serializer.dumps(data)
+        save = measure(lambda: serializer.dumps(data), repeat)
+        load = measure(lambda: serializer.loads(blob), repeat)
+        print(f"- {serializer.name:8} save {save:8.2f} ms / load {load:8.2f} ms / {len(blob) // 1024} KiB")
+
+    parse = measure(lambda: conversation_parser.parse_data(data), repeat)
+    construct = measure(lambda: conversation_parser.construct(data), repeat)
+    print(f"- validated parse {parse:8.2f} ms / trusted construct {construct:8.2f} ms")
+
+
+def create_sample(message_count: int) -> Dict:
+    data = conversation_parser.parse(Path('./data/conversation.yaml')).dict()
+    senders = ('user', 'ai')
+    data['messages'] = [
+        {'sender': senders[i % 2], 'text': f'메시지 {i}: ' + 'lorem ipsum dolor sit amet ' * 4, 'timestamp': '2023-04-03T12:01:00'}
+        for i in range(message_count)
+    ]
+
+    return data
+
+
+def measure(action: Callable[[], object], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        action()
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert cached sessions between storage formats.")
+    parser.add_argument('--source', type=Path, default=Path('./.cache/'), help="directory of cached sessions")
+    parser.add_argument('--source-format', default='yaml', choices=SERIALIZERS)
+    parser.add_argument('--target', type=Path, help="target directory, or database with --sqlite")
+    parser.add_argument('--config', type=Path, default=Path('./config.ini'), help="default database with --sqlite")
+    parser.add_argument('--target-format', default='json', choices=SERIALIZERS)
+    parser.add_argument('--sqlite', action='store_true', help="write into a SQLite session store")
+    parser.add_argument('--benchmark', type=int, metavar='MESSAGES', help="measure formats on a sample session")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.repeat)
+        return
+
+    source = FileSessionStore(args.source, get_serializer(args.source_format))
+    target_serializer = get_serializer(args.target_format)
+
+    if args.sqlite:
+        target_path = args.target or AppConfig(args.config).session_db_path
+        target = SqliteSessionStore(target_path, target_serializer)
+    else:
+        target_path = args.target or args.source
+        target = FileSessionStore(target_path, target_serializer)
+
+    count = convert(source, target)
+    target.close()
+
+    print(f"[Convert] {count} sessions converted to '{target_path}' ({args.target_format})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from scripts.conversation import CONTEXT_LENGTH_MAP, DEFAULT_CONTEXT_LENGTH
+from utils.tokenizer import ApproximateTokenizer
+
+WORDS = ['안녕', '오늘', '정말', '좋아', '그래서', '우리', '같이', '생각', 'hello', 'yes', 'maybe', 'really']
+
+
+@dataclass
+class FakeServerOptions:
+    """Behaviour of the stand-in server. Latency before the first token is log-normal around `latency`."""
+    latency: float = 0.3
+    latency_sigma: float = 0.5
+    tokens_per_second: float = 50.0
+    chunk_tokens: int = 4
+    rate_limit_rate: float = 0.0
+    server_error_rate: float = 0.0
+    retry_after: float = 1.0
+    context_length: Optional[int] = None
+
+
+class FakeOpenAiServer:
+    """Implements the part of the Completions API the bot uses, with synthetic text and injected faults.
+
+    Both `/v1/completions` and `/v1/engines/{engine}/completions` accept `prompt` (a string or a list),
+    `max_tokens`, `n` and `stream`. Prompts over the engine's context length fail with the same message as the real API."""
+
+    def __init__(self, options: FakeServerOptions) -> None:
+        self.options = options
+        self.tokenizer = ApproximateTokenizer()
+
+        self.requests = 0
+        self.completions = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.context_errors = 0
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v1/completions', self._handle)
+        app.router.add_post('/v1/engines/{engine}/completions', self._handle)
+        app.router.add_get('/stats', self._handle_stats)
+        return app
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'requests': self.requests,
+            'completions': self.completions,
+            'rate_limited': self.rate_limited,
+            'server_errors': self.server_errors,
+            'context_errors': self.context_errors,
+        }
+
+    async def _handle_stats(self, _: web.Request) -> web.Response:
+        return web.json_response(self.get_stats())
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.json()
+        engine = request.match_info.get('engine') or body.get('model', '')
+
+        if random.random() < self.options.rate_limit_rate:
+            self.rate_limited += 1
+            return self._error(429, 'requests', "Rate limit reached for requests.", {
+                'Retry-After': str(self.options.retry_after)
+            })
+
+        if random.random() < self.options.server_error_rate:
+            self.server_errors += 1
+            return self._error(503, 'server_error', "The server is overloaded or not ready yet.")
+
+        prompts = body.get('prompt', '')
+        prompts = [prompts] if isinstance(prompts, str) else prompts
+        max_tokens = body.get('max_tokens', 16)
+        context_length = self.options.context_length or CONTEXT_LENGTH_MAP.get(engine, DEFAULT_CONTEXT_LENGTH)
+        prompt_tokens = 0
+        for prompt in prompts:
+            tokens = self.tokenizer.count(prompt)
+            if tokens + max_tokens > context_length:
+                self.context_errors += 1
+                return self._error(400, 'invalid_request_error', (
+                    f"This model's maximum context length is {context_length} tokens, however you requested "
+                    f"{tokens + max_tokens} tokens ({tokens} in your prompt; {max_tokens} for the "
+                    f"completion). Please reduce your prompt; or completion length."
+                ))
+
+            prompt_tokens += tokens
+
+        # Choices of prompt i are numbered from i * n, like the real API.
+        choices = [self._generate(max_tokens) for _ in range(len(prompts) * body.get('n', 1))]
+        await asyncio.sleep(random.lognormvariate(0, self.options.latency_sigma) * self.options.latency)
+        self.completions += 1
+
+        if body.get('stream'):
+            return await self._stream(request, engine, choices)
+
+        await asyncio.sleep(max(len(choice) for choice in choices) / self.options.tokens_per_second)
+        completion_tokens = sum(len(choice) for choice in choices)
+        return web.json_response(self._create_body(engine, [
+            {'text': ''.join(choice), 'index': index, 'logprobs': None, 'finish_reason': 'length'}
+            for index, choice in enumerate(choices)
+        ], {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }))
+
+    async def _stream(self, request: web.Request, engine: str, choices: List[List[str]]) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+
+        size = self.options.chunk_tokens
+        for start in range(0, max(len(choice) for choice in choices), size):
+            for index, choice in enumerate(choices):
+                if start < len(choice):
+                    piece = {'text': ''.join(choice[start:start + size]), 'index': index, 'logprobs': None,
+                             'finish_reason': 'length' if start + size >= len(choice) else None}
+                    await response.write(f"data: {json.dumps(self._create_body(engine, [piece]))}\n\n".encode())
+
+            await asyncio.sleep(size / self.options.tokens_per_second)
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def _generate(max_tokens: int) -> List[str]:
+        """Synthetic tokens, about half of `max_tokens` on average."""
+        count = random.randint(1, max(max_tokens, 1))
+        return [f' {random.choice(WORDS)}' for _ in range(count)]
+
+    @staticmethod
+    def _create_body(engine: str, choices: List[Dict], usage: Optional[Dict] = None) -> Dict:
+        body = {
+            'id': f'cmpl-{uuid.uuid4().hex}',
+            'object': 'text_completion',
+            'created': int(time.time()),
+            'model': engine,
+            'choices': choices,
+        }
+        if usage is not None:
+            body['usage'] = usage
+
+        return body
+
+    @staticmethod
+    def _error(status: int, error_type: str, message: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+        error = {'message': message, 'type': error_type, 'param': None, 'code': None}
+        return web.json_response({'error': error}, status=status, headers=headers)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeServerOptions()
+    parser.add_argument('--latency', type=float, default=defaults.latency, help="median seconds to first token")
+    parser.add_argument('--latency-sigma', type=float, default=defaults.latency_sigma)
+    parser.add_argument('--tokens-per-second', type=float, default=defaults.tokens_per_second)
+    parser.add_argument('--rate-limit-rate', type=float, default=defaults.rate_limit_rate, help="share of 429s")
+    parser.add_argument('--server-error-rate', type=float, default=defaults.server_error_rate, help="share of 503s")
+    parser.add_argument('--retry-after', type=float, default=defaults.retry_after)
+    parser.add_argument('--context-length', type=int, help="override the context length of every engine")
+
+
+def get_options(args: argparse.Namespace) -> FakeServerOptions:
+    return FakeServerOptions(
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        rate_limit_rate=args.rate_limit_rate,
+        server_error_rate=args.server_error_rate,
+        retry_after=args.retry_after,
+        context_length=args.context_length,
+    )
+
+
+async def start_server(server: FakeOpenAiServer, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI Completions API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    print(f"[FakeOpenAI] Set OPEN_AI_API_BASE = http://{args.host}:{args.port}/v1")
+    web.run_app(FakeOpenAiServer(get_options(args)).create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
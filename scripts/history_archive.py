@@ -0,0 +1,149 @@
+import bisect
+import gzip
+import json
+import logging
+import os
+import shutil
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from data.conversation import Message
+from utils.file_io import PathLike, load_json, save_json, fsync_directory, remove_file
+
+# [first id, message count, compressed size]; the size is -1 for segments indexed before sizes were recorded.
+Segment = List[int]
+
+
+class HistoryArchive:
+    """Append-only archive of the messages scrolled out of a session.
+
+    Messages get sequential ids and are stored in gzip-compressed JSON lines segments of at most
+    `segment_size` messages, named after their first id. Every append adds a new gzip member,
+    so nothing already written is rewritten, and a range read only decompresses the segments it overlaps.
+
+    The index is only replaced after the segments it describes were written, and synced first with `fsync`.
+    Bytes past the indexed size of a segment were left by an append the index never recorded, and are cut off
+    when the archive is opened."""
+
+    def __init__(self, directory: PathLike, segment_size: int, fsync: bool = False) -> None:
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.fsync = fsync
+
+        self._segments: List[Segment] = [
+            segment if len(segment) == 3 else [*segment, -1]
+            for segment in load_json(self._get_index_path()).get('segments', [])
+        ]
+        self._repair()
+
+    @property
+    def message_count(self) -> int:
+        if not self._segments:
+            return 0
+
+        first_id, count, _ = self._segments[-1]
+        return first_id + count
+
+    def prepare_append(self, messages: List[Message]) -> List[Tuple[int, bytes]]:
+        """Assign ids to the messages and return the compressed chunks to write, as (segment id, data).
+        The index is updated right away, so ids stay consistent while the chunks are written elsewhere."""
+        chunks = []
+        next_id = self.message_count
+
+        for message in messages:
+            if not self._segments or self._segments[-1][1] >= self.segment_size:
+                self._segments.append([next_id, 0, 0])
+                chunks.append((next_id, []))
+            elif not chunks:
+                chunks.append((self._segments[-1][0], []))
+
+            line = json.dumps({'id': next_id, **message.dict()}, ensure_ascii=False)
+            chunks[-1][1].append(f'{line}\n')
+            self._segments[-1][1] += 1
+            next_id += 1
+
+        compressed = [(first_id, gzip.compress(''.join(lines).encode('utf-8'))) for first_id, lines in chunks]
+
+        sizes = {first_id: len(data) for first_id, data in compressed}
+        for segment in self._segments[-len(compressed):]:
+            if segment[0] in sizes and segment[2] >= 0:
+                segment[2] += sizes[segment[0]]
+
+        return compressed
+
+    def write(self, chunks: List[Tuple[int, bytes]], segments: List[Segment]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        created = False
+        for first_id, data in chunks:
+            path = self._get_segment_path(first_id)
+            created = created or not path.exists()
+
+            with path.open('ab') as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        if self.fsync and created:
+            fsync_directory(self.directory)
+
+        save_json(self._get_index_path(), {'segments': segments}, self.fsync)
+
+    def get_segments(self) -> List[Segment]:
+        return [list(segment) for segment in self._segments]
+
+    def read(self, start: int = 0, end: Optional[int] = None) -> Iterator[Dict]:
+        """Stream archived messages with ids in [start, end)."""
+        end = self.message_count if end is None else min(end, self.message_count)
+        if start >= end:
+            return
+
+        first_ids = [first_id for first_id, _, _ in self._segments]
+        index = max(bisect.bisect_right(first_ids, start) - 1, 0)
+
+        for first_id, count, _ in self._segments[index:]:
+            if first_id >= end:
+                break
+
+            try:
+                with gzip.open(self._get_segment_path(first_id), 'rt', encoding='utf-8') as f:
+                    for line in f:
+                        message = json.loads(line)
+                        if message['id'] >= min(end, first_id + count):
+                            break
+                        if message['id'] >= start:
+                            yield message
+            except (EOFError, gzip.BadGzipFile, zlib.error):
+                # Only an archive written without fsync can lose indexed data in a crash.
+                logging.warning(f"[Archive] Segment {first_id} of '{self.directory}' is truncated.")
+
+    def _repair(self) -> None:
+        if not self.directory.exists():
+            return
+
+        listed = {first_id for first_id, _, _ in self._segments}
+        for path in self.directory.glob('*.jsonl.gz'):
+            if int(path.name.split('.')[0]) not in listed:
+                logging.warning(f"[Archive] Removing unindexed segment '{path}'.")
+                remove_file(path)
+
+        for first_id, _, size in self._segments:
+            path = self._get_segment_path(first_id)
+            if 0 <= size < (path.stat().st_size if path.exists() else 0):
+                logging.warning(f"[Archive] Cutting unindexed appends off segment '{path}'.")
+                with path.open('r+b') as f:
+                    f.truncate(size)
+
+    def clear(self) -> None:
+        self._segments = []
+
+    def remove_files(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _get_index_path(self) -> Path:
+        return self.directory / 'index.json'
+
+    def _get_segment_path(self, first_id: int) -> Path:
+        return self.directory / f'{first_id:010d}.jsonl.gz'
@@ -0,0 +1,103 @@
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+
+from aiohttp import web
+
+from utils.metrics import Counter, Histogram, MetricsRegistry
+
+CommandCallback = TypeVar('CommandCallback', bound=Callable[..., Awaitable[None]])
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = MetricsRegistry()
+
+COMMANDS = REGISTRY.register(Counter(
+    'aigf_commands_total', "Commands handled, by outcome.", ('command', 'status')
+))
+COMMAND_SECONDS = REGISTRY.register(Histogram(
+    'aigf_command_seconds', "Time to handle a command.", ('command',)
+))
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    'aigf_command_phase_seconds', "Time spent in each phase of a command.", ('command', 'phase')
+))
+COMPLETIONS = REGISTRY.register(Counter(
+    'aigf_completions_total', "Completion calls sent to the API, by outcome.", ('engine', 'status')
+))
+COMPLETION_SECONDS = REGISTRY.register(Histogram(
+    'aigf_completion_seconds', "Time for a completion call to finish.", ('engine',)
+))
+COMPLETION_TOKENS = REGISTRY.register(Counter(
+    'aigf_completion_tokens_total', "Tokens of completion calls, as reported or estimated.", ('engine', 'type')
+))
+
+# Name of the command being handled, set once at registration instead of looked up from the stack.
+current_command: ContextVar[str] = ContextVar('current_command', default='background')
+
+
+def instrument_command(name: str, callback: CommandCallback) -> CommandCallback:
+    """Wrap a command callback to count it, time it and make `name` its `current_command`."""
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs) -> None:
+        token = current_command.set(name)
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            await callback(*args, **kwargs)
+            status = 'ok'
+        finally:
+            COMMAND_SECONDS.observe(time.perf_counter() - start, name)
+            COMMANDS.inc(name, status)
+            current_command.reset(token)
+
+    return wrapper
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - start, current_command.get(), name)
+
+
+def record_completion(engine: str, seconds: float, status: str, prompt_tokens: int, completion_tokens: int) -> None:
+    COMPLETIONS.inc(engine, status)
+    COMPLETION_SECONDS.observe(seconds, engine)
+    if prompt_tokens:
+        COMPLETION_TOKENS.inc(engine, 'prompt', amount=prompt_tokens)
+    if completion_tokens:
+        COMPLETION_TOKENS.inc(engine, 'completion', amount=completion_tokens)
+
+
+class MetricsServer:
+    """Serves the registry in the Prometheus text format at `/metrics`."""
+
+    def __init__(self, registry: MetricsRegistry, host: str, port: int) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"[Metrics] Serving metrics at http://{self.host}:{self.port}/metrics")
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, _: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
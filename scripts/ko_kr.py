@@ -57,6 +57,7 @@ RESET_DESC = '설정 초기화'
 
 PRINT = '출력'
 PRINT_DESC = '대화 내용 출력'
+PRINT_ARGS_1 = '전체 대화를 압축 파일로 받기'
 
 DEBUG = '디버그'
 DEBUG_DESC = '디버그 내용 출력'
@@ -69,3 +70,15 @@ CONFIG_ARGS_3 = '상대 이름'
 CONFIG_ARGS_4 = '창의력'
 CONFIG_ARGS_5 = '성격'
 CONFIG_ARGS_6 = '관계'
+
+SEND_QUEUED = '[이전 대화가 끝나면 함께 전달됩니다]'
+
+COMPLETION_UNAVAILABLE = '[인공지능 서버가 불안정합니다. 잠시 후 다시 시도해주세요]'
+COMPLETION_FAILED = '[응답을 받지 못했습니다. 다시 시도해주세요]'
+
+REROLL_LABEL = '다시 생성'
+REROLL_EXPIRED = '[더 이상 다시 생성할 수 없는 응답입니다]'
+
+SESSION_LEASED = '[다른 작업자가 이 대화를 처리하고 있습니다. 잠시 후 다시 시도해주세요]'
+
+EXPORT_TOO_LARGE = '[대화 내용이 너무 길어 파일로 보낼 수 없습니다]'
@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from scripts.batcher import create_batcher
+from scripts.cache_manager import CacheManager
+from scripts.completion import OpenAiBackend
+from scripts.config import AppConfig
+from scripts.conversation import Conversation
+from scripts.fake_openai import FakeOpenAiServer, add_arguments, get_options, start_server
+from scripts.reroll_buffer import create_reroll_buffer
+from scripts.resilience import create_resilient_backend
+from scripts.scheduler import create_scheduler
+from scripts.summarizer import create_summarizer
+
+
+class LoadStats:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {'send': [], 'first_token': [], 'retry': []}
+        self.errors: Dict[str, int] = {}
+        self.cancelled = 0
+
+    def record(self, name: str, seconds: float) -> None:
+        self.latencies[name].append(seconds)
+
+    def record_error(self, error: Exception) -> None:
+        name = type(error).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+class LoadGenerator:
+    """Drives synthetic channels through `Conversation`, each sending `messages` messages with think time between."""
+
+    def __init__(
+            self, config: AppConfig, channels: int, messages: int, think_time: float, retry_rate: float,
+            cancel_rate: float = 0.0, cancel_after: float = 0.5
+    ) -> None:
+        self.config = config
+        self.channels = channels
+        self.messages = messages
+        self.think_time = think_time
+        self.retry_rate = retry_rate
+        self.cancel_rate = cancel_rate
+        self.cancel_after = cancel_after
+
+        self.cache_manager = CacheManager(config)
+        self.backend = create_batcher(
+            config, create_resilient_backend(config, create_scheduler(config, OpenAiBackend(config)))
+        )
+        self.summarizer = create_summarizer(config, self.backend)
+        self.rerolls = create_reroll_buffer(config, self.backend)
+
+        self.stats = LoadStats()
+
+    async def run(self) -> float:
+        start = time.perf_counter()
+        await asyncio.gather(*(self._run_channel(f'load-{index}') for index in range(self.channels)))
+        return time.perf_counter() - start
+
+    async def close(self) -> None:
+        if self.summarizer is not None:
+            await self.summarizer.drain()
+
+        if self.rerolls is not None:
+            self.rerolls.close()
+
+        await self.backend.close()
+        self.cache_manager.close()
+
+    async def _run_channel(self, session_id: str) -> None:
+        cache = self.cache_manager.recreate(session_id)
+        conversation = Conversation(
+            self.config, self.cache_manager, cache, self.backend, self.summarizer, self.rerolls
+        )
+
+        for index in range(self.messages):
+            await asyncio.sleep(random.expovariate(1 / self.think_time) if self.think_time > 0 else 0)
+            await self._send(conversation, f'{index}번째 메시지입니다. 오늘 기분은 어때?')
+
+            if random.random() < self.retry_rate:
+                await self._retry(conversation)
+
+    async def _send(self, conversation: Conversation, message: str) -> None:
+        start = time.perf_counter()
+        first_token: Optional[float] = None
+
+        async def on_partial(*_) -> None:
+            nonlocal first_token
+            if first_token is None:
+                first_token = time.perf_counter() - start
+
+        try:
+            if random.random() < self.cancel_rate:
+                # Cut off before the answer, like a send interrupted by a shutdown.
+                await asyncio.wait_for(
+                    conversation.send(message, on_partial), random.expovariate(1 / self.cancel_after)
+                )
+            else:
+                await conversation.send(message, on_partial)
+        except asyncio.TimeoutError:
+            self.stats.cancelled += 1
+            return
+        except Exception as e:
+            self.stats.record_error(e)
+            return
+
+        self.stats.record('send', time.perf_counter() - start)
+        if first_token is not None:
+            self.stats.record('first_token', first_token)
+
+    async def _retry(self, conversation: Conversation) -> None:
+        start = time.perf_counter()
+        try:
+            await conversation.retry()
+        except Exception as e:
+            self.stats.record_error(e)
+            return
+
+        self.stats.record('retry', time.perf_counter() - start)
+
+
+def report(generator: LoadGenerator, elapsed: float, server: Optional[FakeOpenAiServer]) -> None:
+    stats = generator.stats
+    sends = len(stats.latencies['send'])
+
+    print(f"[Load] {generator.channels} channels x {generator.messages} messages in {elapsed:.1f}s")
+    print(f"- throughput {sends / elapsed:8.1f} sends/s, errors {sum(stats.errors.values())} {stats.errors or ''}")
+    if stats.cancelled:
+        print(f"- cancelled {stats.cancelled} sends")
+    for name, latencies in stats.latencies.items():
+        if latencies:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            print(f"- {name:11} n={len(latencies):6} p50 {p50:8.1f} ms / p95 {p95:8.1f} ms / p99 {p99:8.1f} ms")
+
+    layer = generator.backend
+    while hasattr(layer, 'backend'):
+        print(f"- {type(layer).__name__}: {layer.get_stats()}")
+        layer = layer.backend
+    if server is not None:
+        print(f"- FakeOpenAiServer: {server.get_stats()}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory(prefix='aigf-load-') as directory:
+        await run_in(args, Path(directory))
+
+
+async def run_in(args: argparse.Namespace, tmp: Path) -> None:
+    """Run the load test with sessions and archives stored under `tmp`."""
+    config = AppConfig(args.config)
+    config.cache_path = tmp / 'cache'
+    config.session_db_path = tmp / 'cache' / 'sessions.db'
+    config.archive_path = tmp / 'archive'
+    config.streaming = not args.no_stream
+    config.batch_enabled = args.batch or config.batch_enabled
+    if args.requests_per_minute is not None:
+        config.requests_per_minute = args.requests_per_minute
+    if args.tokens_per_minute is not None:
+        config.tokens_per_minute = args.tokens_per_minute
+    if args.max_concurrency is not None:
+        config.max_concurrent_requests = args.max_concurrency
+
+    server = None
+    runner = None
+    if args.api_base:
+        config.open_ai_api_base = args.api_base
+    else:
+        server = FakeOpenAiServer(get_options(args))
+        runner = await start_server(server, '127.0.0.1', args.port)
+        config.open_ai_api_base = f'http://127.0.0.1:{args.port}/v1'
+        config.open_ai_api_keys = ['sk-local']
+        config.open_ai_organization_ids = []
+
+    generator = LoadGenerator(
+        config, args.channels, args.messages, args.think_time, args.retry_rate, args.cancel_rate, args.cancel_after
+    )
+    try:
+        elapsed = await generator.run()
+        report(generator, elapsed, server)
+    finally:
+        await generator.close()
+        if runner is not None:
+            await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive synthetic channels through Conversation and report latency.")
+    parser.add_argument('--config', type=Path, default=Path('./config.ini'))
+    parser.add_argument('--channels', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=5, help="messages sent per channel")
+    parser.add_argument('--think-time', type=float, default=1.0, help="mean seconds between messages")
+    parser.add_argument('--retry-rate', type=float, default=0.0, help="share of answers followed by a retry")
+    parser.add_argument('--cancel-rate', type=float, default=0.0, help="share of sends cancelled before the answer")
+    parser.add_argument('--cancel-after', type=float, default=0.5, help="mean seconds before a send is cancelled")
+    parser.add_argument('--no-stream', action='store_true')
+    parser.add_argument('--batch', action='store_true', help="batch completions across channels")
+    parser.add_argument('--requests-per-minute', type=int, help="override the scheduler budget, 0 for none")
+    parser.add_argument('--tokens-per-minute', type=int, help="override the scheduler budget, 0 for none")
+    parser.add_argument('--max-concurrency', type=int, help="override the scheduler limit, 0 for none")
+    parser.add_argument('--api-base', help="use a running server instead of starting a local stand-in")
+    parser.add_argument('--port', type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
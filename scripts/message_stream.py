@@ -0,0 +1,48 @@
+import time
+from typing import Optional
+
+import discord
+from discord import Interaction, WebhookMessage, ui
+
+MESSAGE_LIMIT = 2000
+
+
+class FollowupStream:
+    """A followup message showing a response while it is generated.
+
+    The first update is sent right away. Later updates are edited into the same message
+    at most once every `interval` seconds, and `finish` shows the final text."""
+
+    def __init__(self, interaction: Interaction, interval: float) -> None:
+        self.interaction = interaction
+        self.interval = interval
+
+        self._message: Optional[WebhookMessage] = None
+        self._content = ''
+        self._shown_at = 0.0
+
+    async def update(self, content: str) -> None:
+        if self._message is not None and time.monotonic() - self._shown_at < self.interval:
+            return
+
+        await self._show(content[:MESSAGE_LIMIT])
+
+    async def finish(self, content: str, view: ui.View = discord.utils.MISSING) -> None:
+        if self._message is None:
+            # noinspection PyUnresolvedReferences
+            await self.interaction.followup.send(content, view=view)
+        elif content != self._content or view is not discord.utils.MISSING:
+            await self._message.edit(content=content, view=view)
+
+    async def _show(self, content: str) -> None:
+        if content == self._content:
+            return
+
+        if self._message is None:
+            # noinspection PyUnresolvedReferences
+            self._message = await self.interaction.followup.send(content, wait=True)
+        else:
+            self._message = await self._message.edit(content=content)
+
+        self._content = content
+        self._shown_at = time.monotonic()
@@ -0,0 +1,41 @@
+from typing import Awaitable, Callable, Optional
+
+import discord
+from discord import Interaction
+
+from utils.pagination import Page
+
+PAGE_TIMEOUT = 15 * 60
+
+PageCallback = Callable[[Interaction, Optional[int], Optional[int]], Awaitable[Page]]
+
+
+class PageView(discord.ui.View):
+    """Buttons under a page of the history that replace it with the older or newer page.
+
+    `get_page(interaction, start, end)` renders the page from `start` or up to `end` when a button is pressed."""
+
+    def __init__(self, page: Page, get_page: PageCallback) -> None:
+        super().__init__(timeout=PAGE_TIMEOUT)
+        self.page = page
+        self.get_page = get_page
+        self._update_buttons()
+
+    @discord.ui.button(emoji='◀', style=discord.ButtonStyle.secondary)
+    async def older(self, interaction: Interaction, _: discord.ui.Button) -> None:
+        await self._show(interaction, await self.get_page(interaction, None, self.page.start))
+
+    @discord.ui.button(emoji='▶', style=discord.ButtonStyle.secondary)
+    async def newer(self, interaction: Interaction, _: discord.ui.Button) -> None:
+        await self._show(interaction, await self.get_page(interaction, self.page.end, None))
+
+    async def _show(self, interaction: Interaction, page: Page) -> None:
+        self.page = page
+        self._update_buttons()
+
+        # noinspection PyUnresolvedReferences
+        await interaction.response.edit_message(content=page.text, view=self)
+
+    def _update_buttons(self) -> None:
+        self.older.disabled = self.page.start <= self.page.first
+        self.newer.disabled = self.page.end >= self.page.last
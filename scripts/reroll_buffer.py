@@ -0,0 +1,98 @@
+import asyncio
+import dataclasses
+import hashlib
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from scripts.completion import CompletionBackend, CompletionRequest
+from scripts.config import AppConfig
+
+
+class _Candidates:
+    def __init__(self, key: str, request: CompletionRequest) -> None:
+        self.key = key
+        self.request = request
+        self.texts: Deque[str] = deque()
+        self.refill: Optional[asyncio.Task] = None
+
+
+class RerollBuffer:
+    """Spare completions for the last prompt of each session, served by rerolls without a model call.
+
+    Candidates are keyed by a hash of the prompt they answer. Any change to the history changes
+    the prompt, so stale candidates are never served; they are dropped on the next lookup.
+    Once a session's candidates run out, another batch is requested in the background."""
+
+    def __init__(self, backend: CompletionBackend, candidates: int) -> None:
+        self.backend = backend
+        self.candidates = candidates
+
+        self._sessions: Dict[str, _Candidates] = {}
+
+    @staticmethod
+    def get_key(prompt: str) -> str:
+        return hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+
+    def put(self, request: CompletionRequest, key: str, texts: List[str]) -> None:
+        """Keep `texts` as rerolls of `request`, refilling in the background if there are none."""
+        self.discard(request.session_id)
+
+        entry = self._sessions[request.session_id] = _Candidates(key, request)
+        entry.texts.extend(texts)
+        if not entry.texts:
+            self._refill(entry)
+
+    async def take(self, session_id: str, key: str) -> Optional[str]:
+        """A spare completion of the prompt with `key`, waiting for a refill already under way."""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+
+        if entry.key != key:
+            self.discard(session_id)
+            return None
+
+        if not entry.texts and entry.refill is not None:
+            await asyncio.wait([entry.refill])
+
+        if self._sessions.get(session_id) is not entry or not entry.texts:
+            return None
+
+        text = entry.texts.popleft()
+        if not entry.texts:
+            self._refill(entry)
+
+        return text
+
+    def discard(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None and entry.refill is not None:
+            entry.refill.cancel()
+
+    def close(self) -> None:
+        for session_id in list(self._sessions):
+            self.discard(session_id)
+
+    def _refill(self, entry: _Candidates) -> None:
+        if entry.refill is None or entry.refill.done():
+            entry.refill = asyncio.get_running_loop().create_task(self._run(entry))
+
+    async def _run(self, entry: _Candidates) -> None:
+        request = dataclasses.replace(entry.request, n=self.candidates)
+        try:
+            texts = await self.backend.complete_many(request)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception(f"[Reroll] Failed to refill candidates for session '{request.session_id}'.")
+            return
+
+        entry.texts.extend(texts)
+
+
+def create_reroll_buffer(config: AppConfig, backend: CompletionBackend) -> Optional[RerollBuffer]:
+    if config.reroll_candidates <= 1:
+        return None
+
+    return RerollBuffer(backend, config.reroll_candidates)
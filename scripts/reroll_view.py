@@ -0,0 +1,23 @@
+from typing import Awaitable, Callable
+
+import discord
+from discord import Interaction
+
+from scripts.ko_kr import REROLL_LABEL
+
+REROLL_TIMEOUT = 15 * 60
+
+RerollCallback = Callable[[Interaction, str], Awaitable[None]]
+
+
+class RerollView(discord.ui.View):
+    """A button under an answer that asks for another one, as long as it is still the last answer."""
+
+    def __init__(self, timestamp: str, on_reroll: RerollCallback) -> None:
+        super().__init__(timeout=REROLL_TIMEOUT)
+        self.timestamp = timestamp
+        self.on_reroll = on_reroll
+
+    @discord.ui.button(label=REROLL_LABEL, emoji='🎲', style=discord.ButtonStyle.secondary)
+    async def reroll(self, interaction: Interaction, _: discord.ui.Button) -> None:
+        await self.on_reroll(interaction, self.timestamp)
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import random
+import time
+from typing import AsyncIterator, Dict, Optional, Callable, Awaitable, TypeVar, List
+
+import openai
+
+from scripts.completion import CompletionBackend, CompletionRequest
+from scripts.config import AppConfig
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+
+T = TypeVar('T')
+
+
+class CompletionError(Exception):
+    """The backend kept failing after every retry."""
+
+
+class CircuitOpenError(CompletionError):
+    """The backend is considered unhealthy, so the request was not sent."""
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.error.RateLimitError):
+        return error.code != 'insufficient_quota'
+    if isinstance(error, openai.error.APIError) and error.http_status is not None:
+        return error.http_status >= 500 or error.http_status == 429
+
+    return isinstance(error, (*RETRYABLE_ERRORS, asyncio.TimeoutError))
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After') or headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and fails fast for `reset_timeout` seconds.
+    Then a single trial request is let through: success closes the circuit, failure opens it again,
+    and a trial that is cancelled is abandoned so the next request becomes the trial."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._trial_running = False
+
+        if self.state == self.HALF_OPEN:
+            if self._trial_running:
+                return False
+
+            self._trial_running = True
+            return True
+
+        return self.state == self.CLOSED
+
+    def abandon_trial(self) -> None:
+        """Let another trial through after the running one was cancelled before it could tell anything."""
+        self._trial_running = False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logging.info("[Breaker] Completion backend recovered, closing the circuit.")
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logging.warning(f"[Breaker] Opening the circuit after {self.failures} failures.")
+                self.opened += 1
+
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+class ResilientBackend(CompletionBackend):
+    """Retries transient failures with capped exponential backoff and full jitter, waiting at least
+    as long as Retry-After asks, and stops calling an unhealthy backend through a circuit breaker.
+
+    A stream is only retried if it failed before yielding anything. A batch is retried as a whole,
+    so a failed batch counts once towards the breaker however many prompts it carried."""
+
+    def __init__(
+            self,
+            backend: CompletionBackend,
+            breaker: CircuitBreaker,
+            max_retries: int,
+            base_delay: float,
+            max_delay: float
+    ) -> None:
+        self.backend = backend
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            'retries': self.retries,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'breaker_open': int(self.breaker.state == CircuitBreaker.OPEN),
+            'breaker_opened': self.breaker.opened,
+        }
+
+    async def complete(self, request: CompletionRequest) -> str:
+        return await self._call(lambda: self.backend.complete(request))
+
+    async def complete_many(self, request: CompletionRequest) -> List[str]:
+        return await self._call(lambda: self.backend.complete_many(request))
+
+    async def complete_batch(self, requests: List[CompletionRequest]) -> List[List[str]]:
+        return await self._call(lambda: self.backend.complete_batch(requests))
+
+    async def _call(self, action: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            trial = self._check_breaker()
+            try:
+                result = await action()
+            except Exception as e:
+                attempt = await self._handle_failure(e, attempt)
+                continue
+            except BaseException:
+                if trial:
+                    self.breaker.abandon_trial()
+                raise
+
+            self.breaker.record_success()
+            return result
+
+    async def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        attempt = 0
+        while True:
+            trial = self._check_breaker()
+            started = False
+            try:
+                async for piece in self.backend.stream(request):
+                    started = True
+                    yield piece
+            except Exception as e:
+                if started:
+                    self.breaker.record_failure()
+                    raise
+
+                attempt = await self._handle_failure(e, attempt)
+                continue
+            except BaseException:
+                # Cancelled, or closed by the consumer before the end.
+                if trial:
+                    self.breaker.abandon_trial()
+                raise
+
+            self.breaker.record_success()
+            return
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    def _check_breaker(self) -> bool:
+        """Raise if the circuit is open, and return whether the request is the trial of a half-open circuit."""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError("Completion backend is unavailable")
+
+        return self.breaker.state == CircuitBreaker.HALF_OPEN
+
+    async def _handle_failure(self, error: Exception, attempt: int) -> int:
+        """Wait before the next attempt, or raise if the error is final."""
+        if not is_retryable(error):
+            # The backend answered; the request itself was wrong.
+            self.breaker.record_success()
+            raise error
+
+        self.breaker.record_failure()
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        if attempt >= self.max_retries or delay > self.max_delay or self.breaker.state == CircuitBreaker.OPEN:
+            self.failures += 1
+            raise CompletionError(f"Completion failed after {attempt + 1} attempts") from error
+
+        logging.info(f"[Retry] {type(error).__name__}, retrying in {delay:.2f}s (attempt {attempt + 1}).")
+        self.retries += 1
+        await asyncio.sleep(delay)
+        return attempt + 1
+
+
+def create_resilient_backend(config: AppConfig, backend: CompletionBackend) -> ResilientBackend:
+    breaker = CircuitBreaker(config.breaker_failure_threshold, config.breaker_reset_timeout)
+    return ResilientBackend(backend, breaker, config.max_retries, config.retry_base_delay, config.retry_max_delay)
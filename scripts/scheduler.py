@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, List
+
+from scripts.completion import CompletionBackend, CompletionRequest
+from scripts.config import AppConfig
+
+
+class TokenBucket:
+    """Allows `rate` units per minute, with bursts of up to a full minute's worth."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.capacity = rate
+        self.level = rate
+        self._updated = time.monotonic()
+
+    def get_delay(self, amount: float) -> float:
+        """Seconds until `amount` units are available."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0) * 60 / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate / 60)
+        self._updated = now
+
+
+class _Waiter:
+    def __init__(self, future: asyncio.Future, cost: int) -> None:
+        self.future = future
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+
+
+class SchedulerStats:
+    def __init__(self) -> None:
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def record_wait(self, wait: float) -> None:
+        self.dispatched += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.last_wait = wait
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.dispatched if self.dispatched else 0.0
+
+
+class CompletionScheduler(CompletionBackend):
+    """Admits completion requests under requests-per-minute, tokens-per-minute and concurrency limits.
+
+    Requests that do not fit wait in one queue per session. Queues are served round-robin,
+    one request at a time, so a busy channel cannot starve the others. A request costs its
+    prompt tokens plus `max_tokens` for each choice. Only model calls go through here; other commands never wait."""
+
+    def __init__(
+            self,
+            backend: CompletionBackend,
+            requests_per_minute: int = 0,
+            tokens_per_minute: int = 0,
+            max_concurrency: int = 0,
+            slow_wait: float = 1.0
+    ) -> None:
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.slow_wait = slow_wait
+
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        self._rotation: Deque[str] = deque()
+        self._running = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self.stats = SchedulerStats()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            'queue_depth': self.queue_depth,
+            'queued_sessions': len(self._queues),
+            'running': self._running,
+            'dispatched': self.stats.dispatched,
+            'average_wait': self.stats.average_wait,
+            'max_wait': self.stats.max_wait,
+            'last_wait': self.stats.last_wait,
+        }
+
+    async def complete(self, request: CompletionRequest) -> str:
+        async with self._slot(request.session_id, self._get_cost(request)):
+            return await self.backend.complete(request)
+
+    async def complete_many(self, request: CompletionRequest) -> List[str]:
+        async with self._slot(request.session_id, self._get_cost(request)):
+            return await self.backend.complete_many(request)
+
+    async def complete_batch(self, requests: List[CompletionRequest]) -> List[List[str]]:
+        # One call for the whole batch, queued with its first session.
+        cost = sum(self._get_cost(request) for request in requests)
+        async with self._slot(requests[0].session_id, cost):
+            return await self.backend.complete_batch(requests)
+
+    async def stream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        async with self._slot(request.session_id, self._get_cost(request)):
+            async for piece in self.backend.stream(request):
+                yield piece
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+
+        await self.backend.close()
+
+    @staticmethod
+    def _get_cost(request: CompletionRequest) -> int:
+        return request.prompt_tokens + request.max_tokens * request.n
+
+    @asynccontextmanager
+    async def _slot(self, session_id: str, cost: int) -> AsyncIterator[None]:
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), cost)
+        self._enqueue(session_id, waiter)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()
+            else:
+                self._discard(session_id, waiter)
+            raise
+
+        wait = time.monotonic() - waiter.enqueued_at
+        self.stats.record_wait(wait)
+        if wait >= self.slow_wait:
+            logging.info(
+                f"[Scheduler] Session '{session_id}' waited {wait:.1f}s "
+                f"({self.queue_depth} queued, {self._running} running)."
+            )
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _enqueue(self, session_id: str, waiter: _Waiter) -> None:
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = self._queues[session_id] = deque()
+            self._rotation.append(session_id)
+
+        queue.append(waiter)
+        self._dispatch()
+
+    def _discard(self, session_id: str, waiter: _Waiter) -> None:
+        queue = self._queues.get(session_id)
+        if queue is None or waiter not in queue:
+            return
+
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[session_id]
+            self._rotation.remove(session_id)
+
+        self._dispatch()
+
+    def _release(self) -> None:
+        self._running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._rotation:
+            if 0 < self.max_concurrency <= self._running:
+                return
+
+            session_id = self._rotation[0]
+            queue = self._queues[session_id]
+            waiter = queue[0]
+
+            # A cancelled waiter is removed by its own task once it resumes; skip it meanwhile.
+            granted = not waiter.future.done()
+            if granted:
+                delay = self._get_delay(waiter.cost)
+                if delay > 0:
+                    self._wake_after(delay)
+                    return
+
+                if self._requests is not None:
+                    self._requests.take(1)
+                if self._tokens is not None:
+                    self._tokens.take(waiter.cost)
+
+            queue.popleft()
+            if queue:
+                self._rotation.rotate(-1)
+            else:
+                del self._queues[session_id]
+                self._rotation.popleft()
+
+            if granted:
+                self._running += 1
+                waiter.future.set_result(None)
+
+    def _get_delay(self, cost: int) -> float:
+        delay = 0.0
+        if self._requests is not None:
+            delay = max(delay, self._requests.get_delay(1))
+        if self._tokens is not None:
+            delay = max(delay, self._tokens.get_delay(cost))
+
+        return delay
+
+    def _wake_after(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+
+def create_scheduler(config: AppConfig, backend: CompletionBackend) -> CompletionScheduler:
+    return CompletionScheduler(
+        backend,
+        config.requests_per_minute,
+        config.tokens_per_minute,
+        config.max_concurrent_requests
+    )
@@ -0,0 +1,59 @@
+from typing import Dict, Iterable, List
+
+from data.conversation import Message, Settings
+
+Record = Dict
+
+
+def append_record(messages: Iterable[Message]) -> Record:
+    return {'op': 'append', 'messages': [message.dict() for message in messages]}
+
+
+def set_record(index: int, message: Message) -> Record:
+    return {'op': 'set', 'index': index, 'message': message.dict()}
+
+
+def truncate_record(length: int) -> Record:
+    return {'op': 'truncate', 'length': length}
+
+
+def drop_record(count: int) -> Record:
+    return {'op': 'drop', 'count': count}
+
+
+def settings_record(settings: Settings) -> Record:
+    return {'op': 'settings', 'settings': settings.dict()}
+
+
+def summary_record(summary: str) -> Record:
+    return {'op': 'summary', 'summary': summary}
+
+
+def apply_records(data: Dict, records: Iterable[Record]) -> Dict:
+    """Fold journal records into a snapshot, in order."""
+    for record in records:
+        apply_record(data, record)
+
+    return data
+
+
+def apply_record(data: Dict, record: Record) -> None:
+    messages: List[Dict] = data.setdefault('messages', [])
+    op = record['op']
+
+    if op == 'append':
+        messages.extend(record['messages'])
+    elif op == 'set':
+        index = record['index']
+        if -len(messages) <= index < len(messages):
+            messages[index] = record['message']
+    elif op == 'truncate':
+        del messages[record['length']:]
+    elif op == 'drop':
+        del messages[:record['count']]
+    elif op == 'settings':
+        data['settings'] = record['settings']
+    elif op == 'summary':
+        data['summary'] = record['summary']
+    else:
+        raise ValueError(f"Unknown journal record '{op}'")
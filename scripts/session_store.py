@@ -0,0 +1,461 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, List, Callable, Tuple, Iterator
+
+from data import conversation_parser
+from scripts.config import AppConfig
+from scripts.session_journal import Record, apply_records
+from utils.file_io import (
+    PathLike, remove_file, append_lines, load_lines, load_bytes, save_bytes, write_temp, fsync_file, fsync_directory
+)
+from utils.serialization import Serializer, get_serializer
+
+Operation = Tuple[str, object]
+
+
+class SessionLeaseError(Exception):
+    """The session is leased by another process."""
+
+    def __init__(self, session_id: str) -> None:
+        super().__init__(f"Session '{session_id}' is leased by another process")
+        self.session_id = session_id
+
+
+class SessionBatchError(Exception):
+    """A batch failed after the writes of some sessions were already applied."""
+
+    def __init__(self, applied: Set[str]) -> None:
+        super().__init__(f"Batch failed after writing sessions {sorted(applied)}")
+        self.applied = applied
+
+
+class SessionStore(ABC):
+    """Persistent storage of conversation caches, keyed by session id.
+
+    A trusted store only holds data the bot wrote itself, so it can be loaded without validation.
+    A store shared by several processes supports leases, which give each session a single writer."""
+    trusted = False
+    supports_leases = False
+
+    @abstractmethod
+    def get_ids(self) -> Iterable[str]:
+        ...
+
+    @abstractmethod
+    def contains(self, session_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def save(self, session_id: str, data: Dict) -> None:
+        ...
+
+    @abstractmethod
+    def remove(self, session_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    def append_records(self, session_id: str, records: List[Record]) -> None:
+        """Stores without a journal fold the records into a new snapshot right away."""
+        data = self.load(session_id)
+        if data is not None:
+            self.save(session_id, apply_records(data, records))
+
+    def get_journal_length(self, session_id: str) -> int:
+        return 0
+
+    def write_batch(self, writes: Dict[str, List[Operation]]) -> None:
+        """Apply queued operations of many sessions at once. Stores may commit them together.
+        A store that cannot raises `SessionBatchError` with the sessions written before a failure."""
+        applied = set()
+        for session_id, operations in writes.items():
+            try:
+                for kind, payload in operations:
+                    self.apply(session_id, kind, payload)
+            except Exception as e:
+                raise SessionBatchError(applied) from e
+
+            applied.add(session_id)
+
+    def apply(self, session_id: str, kind: str, payload: object) -> None:
+        if kind == 'save':
+            self.save(session_id, payload)
+        elif kind == 'records':
+            self.append_records(session_id, payload)
+        elif kind == 'remove':
+            self.remove(session_id)
+        else:
+            raise ValueError(f"Unknown store operation '{kind}'")
+
+    # A store without lease support belongs to a single process, which therefore holds every lease.
+
+    def acquire_lease(self, session_id: str, owner: str, ttl: float, previous_owner: str = '') -> bool:
+        """Take the session for `ttl` seconds, unless another live owner holds it.
+        Leases of `previous_owner`, a worker this one replaces, count as free."""
+        return True
+
+    def renew_leases(self, owner: str, ttl: float, session_ids: Set[str]) -> Set[str]:
+        """Extend the leases of `owner` and return which of `session_ids` it still holds."""
+        return set(session_ids)
+
+    def release_lease(self, session_id: str, owner: str) -> None:
+        pass
+
+    def holds_lease(self, session_id: str, owner: str) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+    def is_empty(self) -> bool:
+        return next(iter(self.get_ids()), None) is None
+
+    def import_from(self, other: 'SessionStore', transform: Callable[[Dict], Dict] = lambda data: data) -> int:
+        count = 0
+        for session_id in list(other.get_ids()):
+            data = other.load(session_id)
+            if data:
+                self.save(session_id, transform(data))
+                count += 1
+
+        return count
+
+
+class FileSessionStore(SessionStore):
+    """One snapshot file per session plus an append-only JSON lines journal.
+    The directory is listed once and indexed in memory."""
+
+    def __init__(self, directory: PathLike, serializer: Serializer, fsync: bool = False) -> None:
+        self.directory = Path(directory)
+        self.serializer = serializer
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._ids: Set[str] = {path.stem for path in self.directory.glob(f'*{serializer.extension}')}
+
+    def get_ids(self) -> Iterable[str]:
+        with self._lock:
+            return list(self._ids)
+
+    def contains(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._ids
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        if not self.contains(session_id):
+            return None
+
+        data = load_bytes(self._get_path(session_id))
+        if not data:
+            return None
+
+        return apply_records(self.serializer.loads(data), self._load_records(session_id))
+
+    def save(self, session_id: str, data: Dict) -> None:
+        save_bytes(self._get_path(session_id), self.serializer.dumps(data), self.fsync)
+        remove_file(self._get_journal_path(session_id))
+
+        with self._lock:
+            self._ids.add(session_id)
+
+    def append_records(self, session_id: str, records: List[Record]) -> None:
+        append_lines(self._get_journal_path(session_id), self._dump_records(records), self.fsync)
+
+    def get_journal_length(self, session_id: str) -> int:
+        return len(load_lines(self._get_journal_path(session_id)))
+
+    def write_batch(self, writes: Dict[str, List[Operation]]) -> None:
+        """Group commit: write every snapshot to a temporary file, sync them all, then rename them into place
+        and sync the directory once. Journals are appended afterwards and synced together."""
+        snapshots = {}
+        try:
+            for session_id, operations in writes.items():
+                for kind, payload in operations:
+                    if kind == 'save':
+                        snapshots[session_id] = write_temp(self._get_path(session_id), self.serializer.dumps(payload))
+
+            if self.fsync:
+                for temp_path in snapshots.values():
+                    fsync_file(temp_path)
+        except Exception:
+            for temp_path in snapshots.values():
+                remove_file(temp_path)
+            raise
+
+        journals = []
+        applied = set()
+        for session_id, operations in writes.items():
+            try:
+                for kind, payload in operations:
+                    if kind == 'save':
+                        os.replace(snapshots.pop(session_id), self._get_path(session_id))
+                        remove_file(self._get_journal_path(session_id))
+                        with self._lock:
+                            self._ids.add(session_id)
+                    elif kind == 'records':
+                        append_lines(self._get_journal_path(session_id), self._dump_records(payload))
+                        journals.append(self._get_journal_path(session_id))
+                    else:
+                        self.apply(session_id, kind, payload)
+            except Exception as e:
+                for temp_path in snapshots.values():
+                    remove_file(temp_path)
+                raise SessionBatchError(applied) from e
+
+            applied.add(session_id)
+
+        if self.fsync:
+            # Everything is written by now, and writing the journals again would duplicate their records.
+            try:
+                for journal_path in journals:
+                    fsync_file(journal_path)
+
+                fsync_directory(self.directory)
+            except Exception as e:
+                raise SessionBatchError(applied) from e
+
+    def remove(self, session_id: str) -> None:
+        with self._lock:
+            self._ids.discard(session_id)
+
+        remove_file(self._get_path(session_id))
+        remove_file(self._get_journal_path(session_id))
+
+    def clear(self) -> None:
+        for session_id in self.get_ids():
+            self.remove(session_id)
+
+    def _load_records(self, session_id: str) -> List[Record]:
+        records = []
+        for line in load_lines(self._get_journal_path(session_id)):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Only the last append can be torn by a crash; everything before it is intact.
+                logging.warning(f"[Store] Ignoring a torn journal record of session '{session_id}'.")
+                break
+
+        return records
+
+    @staticmethod
+    def _dump_records(records: List[Record]) -> Iterator[str]:
+        return (json.dumps(record, ensure_ascii=False) for record in records)
+
+    def _get_path(self, session_id: str) -> Path:
+        return self.directory / f'{session_id}{self.serializer.extension}'
+
+    def _get_journal_path(self, session_id: str) -> Path:
+        return self.directory / f'{session_id}.journal'
+
+
+class SqliteSessionStore(SessionStore):
+    """All sessions in a single SQLite database, indexed by session id.
+    Journal records are kept in their own table until the next snapshot.
+    Several processes may share the database; leases are rows with an owner and an expiry time.
+    With a `lease_owner`, every write checks in its own transaction that the owner still holds the session's lease."""
+    trusted = True
+    supports_leases = True
+
+    def __init__(self, path: PathLike, serializer: Serializer, fsync: bool = False, lease_owner: str = '') -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.serializer = serializer
+        self.lease_owner = lease_owner
+
+        self._lock = threading.RLock()
+        self._in_batch = False
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute(f"PRAGMA synchronous = {'FULL' if fsync else 'NORMAL'}")
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, format TEXT NOT NULL, data BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS journal_session ON journal (session_id, seq);
+            CREATE TABLE IF NOT EXISTS leases (session_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS lease_owner ON leases (owner);
+        ''')
+        self._connection.commit()
+
+    def get_ids(self) -> Iterable[str]:
+        with self._lock:
+            rows = self._connection.execute('SELECT id FROM sessions').fetchall()
+
+        return [row[0] for row in rows]
+
+    def contains(self, session_id: str) -> bool:
+        with self._lock:
+            row = self._connection.execute('SELECT 1 FROM sessions WHERE id = ?', (session_id,)).fetchone()
+
+        return row is not None
+
+    def load(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT format, data FROM sessions WHERE id = ?', (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            rows = self._connection.execute(
+                'SELECT record FROM journal WHERE session_id = ? ORDER BY seq', (session_id,)
+            ).fetchall()
+
+        data_format, data = row
+        records = (json.loads(record) for record, in rows)
+        return apply_records(get_serializer(data_format).loads(data), records)
+
+    def save(self, session_id: str, data: Dict) -> None:
+        blob = self.serializer.dumps(data)
+
+        with self._transaction():
+            self._check_lease(session_id)
+            self._connection.execute(
+                'INSERT OR REPLACE INTO sessions (id, format, data) VALUES (?, ?, ?)',
+                (session_id, self.serializer.name, blob)
+            )
+            self._connection.execute('DELETE FROM journal WHERE session_id = ?', (session_id,))
+
+    def append_records(self, session_id: str, records: List[Record]) -> None:
+        rows = [(session_id, json.dumps(record, ensure_ascii=False)) for record in records]
+
+        with self._transaction():
+            self._check_lease(session_id)
+            self._connection.executemany('INSERT INTO journal (session_id, record) VALUES (?, ?)', rows)
+
+    def get_journal_length(self, session_id: str) -> int:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT COUNT(*) FROM journal WHERE session_id = ?', (session_id,)
+            ).fetchone()
+
+        return row[0]
+
+    def write_batch(self, writes: Dict[str, List[Operation]]) -> None:
+        """Group commit: every queued operation goes into a single transaction.
+        Sessions whose lease was lost are skipped, so they do not roll back the others."""
+        with self._transaction():
+            self._in_batch = True
+            try:
+                for session_id, operations in writes.items():
+                    try:
+                        self._check_lease(session_id)
+                    except SessionLeaseError:
+                        logging.warning(f"[Store] Dropping writes of session '{session_id}', its lease was lost.")
+                        continue
+
+                    for kind, payload in operations:
+                        self.apply(session_id, kind, payload)
+            finally:
+                self._in_batch = False
+
+    def remove(self, session_id: str) -> None:
+        with self._transaction():
+            self._check_lease(session_id)
+            self._connection.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+            self._connection.execute('DELETE FROM journal WHERE session_id = ?', (session_id,))
+
+    def clear(self) -> None:
+        with self._transaction():
+            self._connection.execute('DELETE FROM sessions')
+            self._connection.execute('DELETE FROM journal')
+
+    def acquire_lease(self, session_id: str, owner: str, ttl: float, previous_owner: str = '') -> bool:
+        now = time.time()
+        with self._transaction():
+            self._connection.execute(
+                '''INSERT INTO leases (session_id, owner, expires_at) VALUES (?, ?, ?)
+                   ON CONFLICT (session_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                   WHERE leases.owner IN (excluded.owner, ?) OR leases.expires_at < ?''',
+                (session_id, owner, now + ttl, previous_owner, now)
+            )
+            row = self._connection.execute('SELECT owner FROM leases WHERE session_id = ?', (session_id,)).fetchone()
+
+        return row[0] == owner
+
+    def renew_leases(self, owner: str, ttl: float, session_ids: Set[str]) -> Set[str]:
+        with self._transaction():
+            self._connection.execute('UPDATE leases SET expires_at = ? WHERE owner = ?', (time.time() + ttl, owner))
+            rows = self._connection.execute('SELECT session_id FROM leases WHERE owner = ?', (owner,)).fetchall()
+
+        return {row[0] for row in rows} & session_ids
+
+    def release_lease(self, session_id: str, owner: str) -> None:
+        with self._transaction():
+            self._connection.execute('DELETE FROM leases WHERE session_id = ? AND owner = ?', (session_id, owner))
+
+    def holds_lease(self, session_id: str, owner: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM leases WHERE session_id = ? AND owner = ? AND expires_at > ?',
+                (session_id, owner, time.time())
+            ).fetchone()
+
+        return row is not None
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            row = self._connection.execute('SELECT 1 FROM sessions LIMIT 1').fetchone()
+
+        return row is None
+
+    def _check_lease(self, session_id: str) -> None:
+        # Runs inside the write's transaction, so the lease cannot be taken over before the write commits.
+        if self.lease_owner and not self.holds_lease(session_id, self.lease_owner):
+            raise SessionLeaseError(session_id)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        with self._lock:
+            if self._in_batch:
+                yield
+                return
+
+            with self._connection:
+                # Take the write lock up front, so reads made in the transaction stay valid until it commits.
+                self._connection.execute('BEGIN IMMEDIATE')
+                yield
+
+
+def validate(data: Dict) -> Dict:
+    return conversation_parser.parse_data(data).dict()
+
+
+def create_session_store(config: AppConfig, lease_owner: str = '') -> SessionStore:
+    serializer = get_serializer(config.session_format)
+
+    if config.session_store == 'file':
+        return FileSessionStore(config.cache_path, serializer, config.fsync)
+
+    if config.session_store == 'yaml':
+        # The original store, whose files are YAML whatever SESSION_FORMAT says.
+        return FileSessionStore(config.cache_path, get_serializer('yaml'), config.fsync)
+
+    if config.session_store == 'sqlite':
+        store = SqliteSessionStore(config.session_db_path, serializer, config.fsync, lease_owner)
+        if config.import_yaml_cache and store.is_empty():
+            store.import_from(FileSessionStore(config.cache_path, get_serializer('yaml')), validate)
+
+        return store
+
+    raise ValueError(f"Unknown session store '{config.session_store}'")
@@ -0,0 +1,275 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Callable, Tuple, Set
+
+from scripts.config import AppConfig
+from scripts.session_journal import Record
+from scripts.session_store import SessionStore, Operation, SessionBatchError
+
+
+class SessionWriter:
+    """Writes session changes straight through to the store."""
+
+    def __init__(self, store: SessionStore) -> None:
+        self.store = store
+
+    def save(self, session_id: str, data: Dict) -> None:
+        self.store.save(session_id, data)
+
+    def append_records(self, session_id: str, records: List[Record]) -> None:
+        self.store.append_records(session_id, records)
+
+    def remove(self, session_id: str) -> None:
+        self.store.remove(session_id)
+
+    def submit(self, session_id: str, task: Callable[[], None]) -> None:
+        """Run a write of a session that is not a store operation, such as an archive append."""
+        task()
+
+    def expedite(self, session_id: str) -> None:
+        pass
+
+    def discard(self, session_id: str) -> None:
+        """Drop the queued changes of a session this process may no longer write."""
+
+    def flush(self, session_id: Optional[str] = None) -> None:
+        """Write what is queued for the session, or for every session, before returning."""
+
+    def close(self) -> None:
+        pass
+
+
+MAX_ATTEMPTS = 5
+
+
+class _PendingWrite:
+    def __init__(self, deadline: float) -> None:
+        self.deadline = deadline
+        self.operations: List[Operation] = []
+        self.attempts = 0
+
+    def add(self, kind: str, payload: object) -> None:
+        if kind in ('save', 'remove'):
+            self.operations.clear()
+        elif kind == 'records' and self.operations and self.operations[-1][0] == 'records':
+            self.operations[-1][1].extend(payload)
+            return
+
+        self.operations.append((kind, payload))
+
+    def prepend(self, earlier: '_PendingWrite') -> None:
+        """Put back operations that failed to be written, unless a snapshot or removal queued since replaces them."""
+        if not self.operations or self.operations[0][0] not in ('save', 'remove'):
+            self.operations[:0] = earlier.operations
+            self.attempts = earlier.attempts
+
+
+class WriteBehindSessionWriter(SessionWriter):
+    """Queues session changes and writes them from a background thread.
+
+    Changes to the same session within `delay` seconds are coalesced: a snapshot or removal
+    supersedes everything queued before it, and consecutive journal records are batched.
+    Everything due at the same time is handed to the store as one batch, so it can share a single commit."""
+
+    def __init__(self, store: SessionStore, delay: float) -> None:
+        super().__init__(store)
+        self.delay = delay
+
+        self._pending: Dict[str, _PendingWrite] = {}
+        self._tasks: List[Tuple[float, str, Callable[[], None]]] = []
+        self._writing: Set[str] = set()
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name='session-writer', daemon=True)
+        self._thread.start()
+
+    def save(self, session_id: str, data: Dict) -> None:
+        self._enqueue(session_id, 'save', data)
+
+    def append_records(self, session_id: str, records: List[Record]) -> None:
+        self._enqueue(session_id, 'records', list(records))
+
+    def remove(self, session_id: str) -> None:
+        self._enqueue(session_id, 'remove', None)
+
+    def submit(self, session_id: str, task: Callable[[], None]) -> None:
+        with self._condition:
+            self._tasks.append((time.monotonic() + self.delay, session_id, task))
+            self._condition.notify()
+
+    def expedite(self, session_id: str) -> None:
+        with self._condition:
+            pending = self._pending.get(session_id)
+            if pending is not None:
+                pending.deadline = time.monotonic()
+                self._condition.notify()
+
+    def discard(self, session_id: str) -> None:
+        with self._condition:
+            self._pending.pop(session_id, None)
+
+    def flush(self, session_id: Optional[str] = None) -> None:
+        if session_id is not None and not self._is_queued(session_id):
+            # Nothing to wait for, so a session without queued writes never waits for the writes of others.
+            return
+
+        with self._write_lock:
+            with self._condition:
+                if session_id is None:
+                    tasks = [task for _, _, task in self._tasks]
+                    self._tasks = []
+
+                    pending = self._pending
+                    self._pending = {}
+                else:
+                    tasks = [task for _, task_session_id, task in self._tasks if task_session_id == session_id]
+                    self._tasks = [entry for entry in self._tasks if entry[1] != session_id]
+
+                    write = self._pending.pop(session_id, None)
+                    pending = {session_id: write} if write is not None else {}
+
+            self._run_tasks(tasks)
+            self._write(pending)
+
+    def _is_queued(self, session_id: str) -> bool:
+        with self._condition:
+            return (
+                session_id in self._pending or session_id in self._writing
+                or any(task_session_id == session_id for _, task_session_id, _ in self._tasks)
+            )
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        self._thread.join()
+        self.flush()
+
+    def _enqueue(self, session_id: str, kind: str, payload: object) -> None:
+        with self._condition:
+            pending = self._pending.get(session_id)
+            if pending is None:
+                pending = self._pending[session_id] = _PendingWrite(time.monotonic() + self.delay)
+                self._condition.notify()
+
+            pending.add(kind, payload)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and not self._has_due_writes():
+                    self._condition.wait(self._get_wait_time())
+
+                if self._closed:
+                    return
+
+            self._write_due()
+
+    def _write_due(self) -> None:
+        with self._write_lock:
+            with self._condition:
+                now = time.monotonic()
+                due = {key: value for key, value in self._pending.items() if value.deadline <= now}
+                for session_id in due:
+                    del self._pending[session_id]
+
+                # Tasks share one delay, so the due ones are always the oldest.
+                due_count = sum(1 for deadline, _, _ in self._tasks if deadline <= now)
+                tasks = [task for _, _, task in self._tasks[:due_count]]
+                self._writing = set(due).union(session_id for _, session_id, _ in self._tasks[:due_count])
+                del self._tasks[:due_count]
+
+            try:
+                self._run_tasks(tasks)
+                self._write(due)
+            finally:
+                with self._condition:
+                    self._writing = set()
+
+    def _has_due_writes(self) -> bool:
+        now = time.monotonic()
+        due_tasks = self._tasks and self._tasks[0][0] <= now
+        return due_tasks or any(pending.deadline <= now for pending in self._pending.values())
+
+    def _get_wait_time(self) -> Optional[float]:
+        deadlines = [pending.deadline for pending in self._pending.values()]
+        if self._tasks:
+            deadlines.append(self._tasks[0][0])
+
+        if not deadlines:
+            return None
+
+        return max(min(deadlines) - time.monotonic(), 0)
+
+    @staticmethod
+    def _run_tasks(tasks: List[Callable[[], None]]) -> None:
+        for task in tasks:
+            try:
+                task()
+            except Exception:
+                logging.exception("[Writer] Failed to run a write task.")
+
+    def _write(self, pending: Dict[str, _PendingWrite]) -> None:
+        """Write a batch together. If that fails, write each session that was not applied on its own
+        so one bad session does not lose the others, and queue the sessions that still fail to be tried again."""
+        if not pending:
+            return
+
+        try:
+            self.store.write_batch({session_id: write.operations for session_id, write in pending.items()})
+            return
+        except SessionBatchError as e:
+            error = e
+            pending = {session_id: write for session_id, write in pending.items() if session_id not in e.applied}
+        except Exception as e:
+            error = e
+
+        if not pending:
+            logging.error("[Writer] Failed to finish writing a batch after every session was written.", exc_info=error)
+            return
+        elif len(pending) == 1:
+            session_id, write = next(iter(pending.items()))
+            self._retry(session_id, write, error)
+            return
+
+        logging.error(f"[Writer] Failed to write sessions {list(pending)} together, writing them one by one.",
+                      exc_info=error)
+        for session_id, write in pending.items():
+            try:
+                self.store.write_batch({session_id: write.operations})
+            except SessionBatchError as e:
+                if session_id in e.applied:
+                    logging.exception(f"[Writer] Failed to finish writing session '{session_id}' after it was written.")
+                else:
+                    self._retry(session_id, write, e)
+            except Exception as e:
+                self._retry(session_id, write, e)
+
+    def _retry(self, session_id: str, write: _PendingWrite, error: Exception) -> None:
+        write.attempts += 1
+        if write.attempts >= MAX_ATTEMPTS:
+            logging.error(f"[Writer] Failed to write session '{session_id}' {write.attempts} times, dropping it.",
+                          exc_info=error)
+            return
+
+        logging.error(f"[Writer] Failed to write session '{session_id}', trying again later.", exc_info=error)
+        with self._condition:
+            newer = self._pending.get(session_id)
+            if newer is None:
+                write.deadline = time.monotonic() + self.delay
+                self._pending[session_id] = write
+            else:
+                newer.prepend(write)
+
+            self._condition.notify()
+
+
+def create_session_writer(config: AppConfig, store: SessionStore) -> SessionWriter:
+    if config.write_behind:
+        return WriteBehindSessionWriter(store, config.write_behind_delay)
+
+    return SessionWriter(store)
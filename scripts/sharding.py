@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from multiprocessing.context import SpawnProcess
+from pathlib import Path
+from typing import Dict
+
+from scripts.bot import DiscordBot, EventLike
+from scripts.config import AppConfig
+from scripts.session_store import create_session_store
+
+RESTART_DELAY = 5.0
+
+
+def get_lease_owner(shard_id: int, pid: int) -> str:
+    return f'{socket.gethostname()}:{pid}:shard-{shard_id}'
+
+
+def run_worker(config_path: Path, shard_id: int, stop_event: EventLike, previous_owner: str) -> None:
+    logging.basicConfig(level=logging.INFO)
+    config = AppConfig(config_path)
+    lease_owner = get_lease_owner(shard_id, os.getpid())
+
+    async def run() -> None:
+        async with DiscordBot(config, shard_id, lease_owner, previous_owner, stop_event) as bot:
+            await asyncio.gather(bot.create_run_task(), bot.create_exit_task())
+
+    asyncio.run(run())
+
+
+class ShardSupervisor:
+    """Runs one worker process per gateway shard. Discord routes every guild, and so every channel,
+    to a fixed shard. A worker that dies is restarted and takes over the leases of its predecessor."""
+
+    def __init__(self, config_path: Path, config: AppConfig) -> None:
+        self.config_path = config_path
+        self.config = config
+
+        self._context = multiprocessing.get_context('spawn')
+        self._stop_event = self._context.Event()
+        self._workers: Dict[int, SpawnProcess] = {}
+
+    def run(self) -> None:
+        # Prepare the shared store once, before the workers open it together.
+        create_session_store(self.config).close()
+
+        for shard_id in range(self.config.shard_count):
+            self._start(shard_id)
+
+        threading.Thread(target=self._wait_for_input, daemon=True).start()
+
+        while not self._stop_event.wait(1.0):
+            for shard_id, worker in list(self._workers.items()):
+                if not worker.is_alive() and not self._stop_event.is_set():
+                    logging.warning(f"[Shard] Worker of shard {shard_id} exited with {worker.exitcode}, restarting...")
+                    time.sleep(RESTART_DELAY)
+                    self._start(shard_id, get_lease_owner(shard_id, worker.pid))
+
+        for worker in self._workers.values():
+            worker.join()
+
+        logging.info("[Shard] Every worker stopped.")
+
+    def _start(self, shard_id: int, previous_owner: str = '') -> None:
+        worker = self._context.Process(
+            target=run_worker,
+            args=(self.config_path, shard_id, self._stop_event, previous_owner),
+            name=f'shard-{shard_id}'
+        )
+        worker.start()
+        self._workers[shard_id] = worker
+        logging.info(f"[Shard] Started shard {shard_id}/{self.config.shard_count} as process {worker.pid}.")
+
+    def _wait_for_input(self) -> None:
+        input("[System] Press Enter to exit bot...\n")
+        logging.info("[Shard] Stopping every worker...")
+        self._stop_event.set()
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Iterator
+
+from data.history import History
+from scripts.completion import CompletionBackend, CompletionRequest
+from scripts.config import AppConfig
+
+SUMMARY_PROMPT = '''\
+The document is a summary of the conversation between "{user}" and "{ai}", updated with new messages.
+
+[Summary]
+{summary}
+
+[New Messages]
+{messages}
+
+[Rules]
+Rewrite the summary so that it also covers the new messages.
+Keep names, facts, promises and feelings that matter later, and drop small talk.
+Write a few sentences in the language of the conversation.
+
+[Updated Summary]
+'''
+
+
+class Summarizer:
+    """Condenses messages scrolled out of a session into its rolling summary.
+
+    Work runs as a background task per session, off the request path. Messages scrolled out
+    while a summary is being written are queued and folded in by the same task afterwards."""
+
+    def __init__(self, backend: CompletionBackend, max_tokens: int, chunk_tokens: int) -> None:
+        self.backend = backend
+        self.max_tokens = max_tokens
+        self.chunk_tokens = chunk_tokens
+
+        self._pending: Dict[str, List[str]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, history: History, lines: List[str], on_summary: Callable[[str], None]) -> None:
+        if not lines:
+            return
+
+        session_id = history.session.id
+        self._pending.setdefault(session_id, []).extend(lines)
+
+        if session_id not in self._tasks:
+            task = asyncio.get_running_loop().create_task(self._run(session_id, history, on_summary))
+            self._tasks[session_id] = task
+
+    def is_pending(self, session_id: str) -> bool:
+        return session_id in self._tasks
+
+    def cancel(self, session_id: str) -> None:
+        self._pending.pop(session_id, None)
+
+        task = self._tasks.pop(session_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def drain(self) -> None:
+        """Wait for every queued summary to be written."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, session_id: str, history: History, on_summary: Callable[[str], None]) -> None:
+        try:
+            while self._pending.get(session_id):
+                lines = self._pending.pop(session_id)
+                for chunk in self._split(history, lines):
+                    summary = await self.summarize(history, chunk)
+                    if summary:
+                        on_summary(summary)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception(f"[Summarizer] Failed to summarize session '{session_id}'.")
+        finally:
+            if self._tasks.get(session_id) is asyncio.current_task():
+                del self._tasks[session_id]
+
+    async def summarize(self, history: History, lines: List[str]) -> str:
+        prompt = SUMMARY_PROMPT.format(
+            user=history.get_sender_name('user'),
+            ai=history.get_sender_name('ai'),
+            summary=history.summary or '(empty)',
+            messages='\n'.join(lines),
+        )
+        request = CompletionRequest(
+            engine=history.settings.engineName,
+            prompt=prompt,
+            max_tokens=self.max_tokens,
+            temperature=0.3,
+            session_id=history.session.id,
+            prompt_tokens=history.tokenizer.estimate(history.tokenizer.count(prompt)),
+        )
+
+        summary = await self.backend.complete(request)
+        return summary.strip()
+
+    def _split(self, history: History, lines: List[str]) -> Iterator[List[str]]:
+        """Chunks of lines small enough to summarize in one request."""
+        chunk = []
+        tokens = 0
+        for line in lines:
+            line_tokens = history.tokenizer.count(line)
+            if chunk and tokens + line_tokens > self.chunk_tokens:
+                yield chunk
+                chunk = []
+                tokens = 0
+
+            chunk.append(line)
+            tokens += line_tokens
+
+        if chunk:
+            yield chunk
+
+
+def create_summarizer(config: AppConfig, backend: CompletionBackend) -> Optional[Summarizer]:
+    if not config.summary_enabled:
+        return None
+
+    return Summarizer(backend, config.summary_max_tokens, config.summary_chunk_tokens)
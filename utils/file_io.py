@@ -1,9 +1,13 @@
 import json
+import os
+import tempfile
 from pathlib import Path
-from typing import Dict, Union
+from typing import Dict, Union, Iterable, List, Optional
 
 import yaml
 
+from utils.serialization import YamlLoader, YamlDumper
+
 PathLike = Union[str, Path]
 
 
@@ -14,16 +18,14 @@ def remove_file(path: PathLike) -> None:
 def load_yaml(path: PathLike) -> Dict:
     try:
         with Path(path).open(encoding='utf-8') as f:
-            return yaml.safe_load(f)
+            return yaml.load(f, Loader=YamlLoader)
     except FileNotFoundError:
         return {}
 
 
-def save_yaml(path: PathLike, data: Dict) -> None:
-    Path(path).parent.mkdir(parents=True, exist_ok=True)
-
-    with Path(path).open('w', encoding='utf-8') as f:
-        yaml.safe_dump(data, f, allow_unicode=True, default_flow_style=False)
+def save_yaml(path: PathLike, data: Dict, fsync: bool = False) -> None:
+    text = yaml.dump(data, Dumper=YamlDumper, allow_unicode=True, default_flow_style=False)
+    save_bytes(path, text.encode('utf-8'), fsync)
 
 
 def load_json(path: PathLike) -> Dict:
@@ -34,11 +36,60 @@ def load_json(path: PathLike) -> Dict:
         return {}
 
 
-def save_json(path: PathLike, data: Dict) -> None:
+def save_json(path: PathLike, data: Dict, fsync: bool = False) -> None:
+    text = json.dumps(data, ensure_ascii=False, indent=4)
+    save_bytes(path, text.encode('utf-8'), fsync)
+
+
+def load_bytes(path: PathLike) -> Optional[bytes]:
+    try:
+        return Path(path).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def save_bytes(path: PathLike, data: bytes, fsync: bool = False) -> None:
+    """Replace a file atomically: readers see either the old or the new content, never a partial write."""
+    temp_path = write_temp(path, data, fsync)
+    os.replace(temp_path, path)
+
+    if fsync:
+        fsync_directory(Path(path).parent)
+
+
+def write_temp(path: PathLike, data: bytes, fsync: bool = False) -> Path:
+    """Write data to a temporary file next to `path`, ready to be renamed over it."""
     Path(path).parent.mkdir(parents=True, exist_ok=True)
 
-    with Path(path).open('w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    fd, temp_path = tempfile.mkstemp(dir=Path(path).parent, prefix=f'.{Path(path).name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        remove_file(temp_path)
+        raise
+
+    return Path(temp_path)
+
+
+def fsync_file(path: PathLike) -> None:
+    with Path(path).open('rb') as f:
+        os.fsync(f.fileno())
+
+
+def fsync_directory(path: PathLike) -> None:
+    # Directories cannot be opened for syncing on Windows, where renames are already durable.
+    if os.name == 'nt':
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 def load_txt_strip(path: PathLike) -> str:
@@ -49,7 +100,23 @@ def load_txt(path: PathLike) -> str:
     return Path(path).read_text(encoding='utf-8', errors='ignore')
 
 
-def save_txt(path: PathLike, text: str) -> None:
+def save_txt(path: PathLike, text: str, fsync: bool = False) -> None:
+    save_bytes(path, text.encode('utf-8'), fsync)
+
+
+def load_lines(path: PathLike) -> List[str]:
+    try:
+        with Path(path).open(encoding='utf-8') as f:
+            return [line for line in f.read().splitlines() if line]
+    except FileNotFoundError:
+        return []
+
+
+def append_lines(path: PathLike, lines: Iterable[str], fsync: bool = False) -> None:
     Path(path).parent.mkdir(parents=True, exist_ok=True)
 
-    Path(path).write_text(text, encoding='utf-8')
+    with Path(path).open('a', encoding='utf-8') as f:
+        f.writelines(f'{line}\n' for line in lines)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,108 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Iterator, Optional, Tuple, TypeVar
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class LruCache(Generic[K, V]):
+    """Least-recently-used cache bounded by entry count, total weight and idle time.
+
+    A limit of zero disables that bound. Entries for which `can_evict` returns False are skipped."""
+
+    def __init__(
+            self,
+            max_size: int = 0,
+            max_weight: int = 0,
+            max_idle: float = 0,
+            weigh: Callable[[V], int] = lambda value: 1,
+            on_evict: Optional[Callable[[K, V], None]] = None,
+            can_evict: Callable[[V], bool] = lambda value: True
+    ) -> None:
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self.max_idle = max_idle
+
+        self._weigh = weigh
+        self._on_evict = on_evict
+        self._can_evict = can_evict
+        self._entries: OrderedDict[K, Tuple[V, float]] = OrderedDict()
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(list(self._entries))
+
+    def values(self) -> Iterator[V]:
+        return (value for value, _ in list(self._entries.values()))
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        self._entries[key] = entry[0], time.monotonic()
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: K, value: V) -> None:
+        self._entries[key] = value, time.monotonic()
+        self._entries.move_to_end(key)
+
+        self.evict()
+
+    def pop(self, key: K) -> Optional[V]:
+        entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self) -> None:
+        for key in list(self._entries):
+            self._evict(key)
+
+    def evict(self) -> None:
+        self._evict_idle()
+        self._evict_oversize()
+
+    def _evict_idle(self) -> None:
+        if self.max_idle <= 0:
+            return
+
+        deadline = time.monotonic() - self.max_idle
+        for key, (value, last_access) in list(self._entries.items()):
+            if last_access > deadline:
+                break
+
+            if self._can_evict(value):
+                self._evict(key)
+
+    def _evict_oversize(self) -> None:
+        weight = sum(self._weigh(value) for value, _ in self._entries.values()) if self.max_weight > 0 else 0
+
+        for key, (value, _) in list(self._entries.items()):
+            if not self._is_oversize(weight):
+                break
+
+            # The most recently used entry always stays resident.
+            if key == next(reversed(self._entries)):
+                break
+
+            if self._can_evict(value):
+                if self.max_weight > 0:
+                    weight -= self._weigh(value)
+
+                self._evict(key)
+
+    def _is_oversize(self, weight: int) -> bool:
+        too_many = 0 < self.max_size < len(self._entries)
+        too_heavy = 0 < self.max_weight < weight
+        return too_many or too_heavy
+
+    def _evict(self, key: K) -> None:
+        value, _ = self._entries.pop(key)
+        if self._on_evict:
+            self._on_evict(key, value)
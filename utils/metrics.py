@@ -0,0 +1,141 @@
+import bisect
+import math
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, TypeVar
+
+Labels = Tuple[str, ...]
+
+M = TypeVar('M', bound='Metric')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.description}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield from self._render_samples()
+
+    @abstractmethod
+    def _render_samples(self) -> Iterator[str]:
+        ...
+
+    def _format(self, suffix: str, labels: Labels, value: float, extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(label)}"' for name, label in zip(self.label_names, labels)]
+        if extra:
+            pairs.append(extra)
+
+        label_text = '{' + ','.join(pairs) + '}' if pairs else ''
+        return f'{self.name}{suffix}{label_text} {_format_value(value)}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _render_samples(self) -> Iterator[str]:
+        for labels, value in self._values.items():
+            yield self._format('', labels, value)
+
+
+class Gauge(Metric):
+    """Read from `collect` when scraped, so nothing is updated on the hot path."""
+    kind = 'gauge'
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            collect: Callable[[], Dict[Labels, float]],
+            label_names: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, description, label_names)
+        self.collect = collect
+
+    def _render_samples(self) -> Iterator[str]:
+        for labels, value in self.collect().items():
+            yield self._format('', labels, value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            label_names: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+        # Count per bucket, the last one being +Inf, and the sum of observations per label set.
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[labels] = self._sums.get(labels, 0.0) + value
+
+    def _render_samples(self) -> Iterator[str]:
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield self._format('_bucket', labels, cumulative, f'le="{_format_value(bound)}"')
+
+            yield self._format('_sum', labels, self._sums[labels])
+            yield self._format('_count', labels, cumulative)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str) -> None:
+        self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
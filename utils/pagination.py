@@ -0,0 +1,82 @@
+from typing import NamedTuple, Sequence, overload, List
+
+ELLIPSIS = '…'
+
+
+class Page(NamedTuple):
+    """Lines [start, end) joined into `text`, out of the lines [first, last) that can be paged through."""
+    text: str
+    start: int
+    end: int
+    first: int
+    last: int
+
+    def shift(self, offset: int) -> 'Page':
+        return Page(self.text, self.start + offset, self.end + offset, self.first + offset, self.last + offset)
+
+
+class ChainedLines(Sequence[str]):
+    """Two sequences read as one, so a few header lines can precede a long list without copying it."""
+
+    def __init__(self, head: Sequence[str], tail: Sequence[str]) -> None:
+        self.head = head
+        self.tail = tail
+
+    def __len__(self) -> int:
+        return len(self.head) + len(self.tail)
+
+    @overload
+    def __getitem__(self, index: int) -> str:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[str]:
+        ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        return self.head[index] if index < len(self.head) else self.tail[index - len(self.head)]
+
+
+def get_page_before(lines: Sequence[str], end: int, limit: int) -> Page:
+    """The longest run of lines ending at `end` that fits into `limit` characters.
+
+    Only the lines of the page are read, so turning a page costs the same however long `lines` is."""
+    end = min(max(end, 1), len(lines))
+    start = end
+    size = -1
+    while start > 0 and size + len(lines[start - 1]) + 1 <= limit:
+        start -= 1
+        size += len(lines[start]) + 1
+
+    if start == end and end > 0:
+        # A single line longer than a page is shown cut.
+        return Page(_cut(lines[end - 1], limit), end - 1, end, 0, len(lines))
+
+    return Page('\n'.join(lines[start:end]), start, end, 0, len(lines))
+
+
+def get_page_after(lines: Sequence[str], start: int, limit: int) -> Page:
+    """The longest run of lines starting at `start` that fits into `limit` characters."""
+    start = min(max(start, 0), max(len(lines) - 1, 0))
+    end = start
+    size = -1
+    while end < len(lines) and size + len(lines[end]) + 1 <= limit:
+        size += len(lines[end]) + 1
+        end += 1
+
+    if start == end and start < len(lines):
+        return Page(_cut(lines[start], limit), start, start + 1, 0, len(lines))
+
+    return Page('\n'.join(lines[start:end]), start, end, 0, len(lines))
+
+
+def _cut(line: str, limit: int) -> str:
+    return line[:limit - len(ELLIPSIS)] + ELLIPSIS
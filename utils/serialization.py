@@ -0,0 +1,75 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Dict
+
+import yaml
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+class Serializer(ABC):
+    name = ''
+    extension = ''
+
+    @abstractmethod
+    def dumps(self, data: Dict) -> bytes:
+        ...
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Dict:
+        ...
+
+
+class YamlSerializer(Serializer):
+    """YAML through libyaml when PyYAML was built with it."""
+    name = 'yaml'
+    extension = '.yaml'
+
+    def dumps(self, data: Dict) -> bytes:
+        text = yaml.dump(data, Dumper=YamlDumper, allow_unicode=True, default_flow_style=False)
+        return text.encode('utf-8')
+
+    def loads(self, data: bytes) -> Dict:
+        return yaml.load(data, Loader=YamlLoader)
+
+
+class JsonSerializer(Serializer):
+    name = 'json'
+    extension = '.json'
+
+    def dumps(self, data: Dict) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data: bytes) -> Dict:
+        return json.loads(data)
+
+
+class MsgpackSerializer(Serializer):
+    name = 'msgpack'
+    extension = '.msgpack'
+
+    def dumps(self, data: Dict) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Dict:
+        return msgpack.unpackb(data, raw=False)
+
+
+SERIALIZERS = {serializer.name: serializer for serializer in (YamlSerializer(), JsonSerializer(), MsgpackSerializer())}
+
+
+def get_serializer(name: str) -> Serializer:
+    serializer = SERIALIZERS.get(name.lower())
+    if serializer is None:
+        raise ValueError(f"Unknown serialization format '{name}'")
+
+    if serializer is SERIALIZERS['msgpack'] and msgpack is None:
+        raise ValueError("The 'msgpack' format requires the msgpack package")
+
+    return serializer
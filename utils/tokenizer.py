@@ -0,0 +1,68 @@
+import logging
+import math
+import re
+from abc import ABC, abstractmethod
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+WORD_PATTERN = re.compile(r"[A-Za-z]+|[0-9]|\s+|[\x00-\x7f]|[^\x00-\x7f]")
+
+
+class Tokenizer(ABC):
+    """Counts prompt tokens locally. `scale` corrects the estimate after the server reports the real count."""
+
+    def __init__(self) -> None:
+        self.scale = 1.0
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        ...
+
+    def estimate(self, tokens: int) -> int:
+        return math.ceil(tokens * self.scale)
+
+    def calibrate(self, counted: int, actual: int, weight: float = 0.5) -> None:
+        if counted <= 0 or actual <= 0:
+            return
+
+        ratio = actual / counted
+        self.scale = (1 - weight) * self.scale + weight * ratio
+        logging.info(f"[Tokenizer] Calibrated scale to {self.scale:.3f} (counted {counted}, actual {actual}).")
+
+
+class ApproximateTokenizer(Tokenizer):
+    """Offline estimate close to GPT BPE: about four letters per token for Latin words,
+    one token per digit, space run or symbol, and two tokens per character outside ASCII."""
+
+    def count(self, text: str) -> int:
+        tokens = 0
+        for match in WORD_PATTERN.finditer(text):
+            word = match.group()
+            if word[0].isascii():
+                tokens += math.ceil(len(word) / 4) if word[0].isalpha() else 1
+            else:
+                tokens += 2
+
+        return tokens
+
+
+class TiktokenTokenizer(Tokenizer):
+    def __init__(self, engine_name: str) -> None:
+        super().__init__()
+        self._encoding = tiktoken.encoding_for_model(engine_name)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text))
+
+
+def create_tokenizer(name: str, engine_name: str) -> Tokenizer:
+    if name == 'tiktoken':
+        if tiktoken is not None:
+            return TiktokenTokenizer(engine_name)
+
+        logging.warning("[Tokenizer] tiktoken is not installed, falling back to the approximate tokenizer.")
+
+    return ApproximateTokenizer()
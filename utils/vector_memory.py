@@ -0,0 +1,162 @@
+import re
+import zlib
+from abc import ABC, abstractmethod
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+Memory = Tuple[int, float, str]
+
+
+class Embedder(ABC):
+    """Maps texts to L2-normalized float32 vectors of `dimension` entries."""
+
+    def __init__(self, dimension: int) -> None:
+        self.dimension = dimension
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        ...
+
+
+class HashingEmbedder(Embedder):
+    """Offline embedding by feature hashing: words and, for words outside ASCII,
+    character bigrams are hashed into signed buckets, so particles attached to Korean words still match."""
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self._get_features(text):
+                code = zlib.crc32(feature.encode('utf-8'))
+                rows.append(row)
+                columns.append(code % self.dimension)
+                signs.append(1.0 if code & 0x80000000 else -1.0)
+
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(vectors, (rows, columns), signs)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    @staticmethod
+    def _get_features(text: str) -> List[str]:
+        features = []
+        for word in TOKEN_PATTERN.findall(text.lower()):
+            features.append(word)
+            if not word.isascii():
+                features.extend(word[i:i + 2] for i in range(len(word) - 1))
+
+        return features
+
+
+class VectorMemory:
+    """Embedded messages of a session in one contiguous matrix, ordered by message id.
+
+    Ids only ever grow at the end, so deleting the newest messages is a binary search and a truncation.
+    The matrix doubles its capacity when full, which keeps appends amortized O(1)."""
+
+    def __init__(self, embedder: Embedder, top_k: int = 4, min_score: float = 0.0, capacity: int = 64) -> None:
+        self.embedder = embedder
+        self.top_k = top_k
+        self.min_score = min_score
+
+        self._vectors = np.zeros((capacity, embedder.dimension), dtype=np.float32)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._lines: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    @property
+    def nbytes(self) -> int:
+        return self._vectors.nbytes + self._ids.nbytes
+
+    def add(self, ids: Sequence[int], texts: Sequence[str], lines: Sequence[str]) -> None:
+        """Append messages, whose ids must be greater than every id already stored."""
+        if not ids:
+            return
+
+        size = len(self._lines)
+        self._reserve(size + len(ids))
+
+        self._vectors[size:size + len(ids)] = self.embedder.embed(texts)
+        self._ids[size:size + len(ids)] = ids
+        self._lines.extend(lines)
+
+    def create_empty(self) -> 'VectorMemory':
+        return VectorMemory(self.embedder, self.top_k, self.min_score)
+
+    def prepend(self, other: 'VectorMemory') -> None:
+        """Put the messages of `other`, whose ids are all below those stored here, in front of them."""
+        size = len(self._lines)
+        count = len(other._lines)
+        if count == 0:
+            return
+
+        vectors = np.zeros((max(size + count, len(self._ids)), self.embedder.dimension), dtype=np.float32)
+        vectors[:count] = other._vectors[:count]
+        vectors[count:count + size] = self._vectors[:size]
+        ids = np.zeros(len(vectors), dtype=np.int64)
+        ids[:count] = other._ids[:count]
+        ids[count:count + size] = self._ids[:size]
+
+        self._vectors = vectors
+        self._ids = ids
+        self._lines[:0] = other._lines[:count]
+
+    def truncate(self, message_id: int) -> None:
+        """Forget every message with an id of `message_id` or above."""
+        size = self._search(message_id)
+        del self._lines[size:]
+
+    def clear(self) -> None:
+        self._lines.clear()
+
+    def search(self, text: str, end: int) -> List[Memory]:
+        """Top `top_k` messages with ids below `end` by cosine similarity to `text`, as (id, score, line)."""
+        k = self.top_k
+        size = self._search(end)
+        if k <= 0 or size == 0:
+            return []
+
+        query = self.embedder.embed([text])[0]
+        scores = self._vectors[:size] @ query
+
+        if size > k:
+            candidates = np.argpartition(scores, size - k)[size - k:]
+        else:
+            candidates = np.arange(size)
+
+        candidates = candidates[scores[candidates] > self.min_score]
+        candidates = candidates[np.argsort(-scores[candidates])]
+
+        return [(int(self._ids[index]), float(scores[index]), self._lines[index]) for index in candidates]
+
+    def _search(self, message_id: int) -> int:
+        return int(np.searchsorted(self._ids[:len(self._lines)], message_id))
+
+    def _reserve(self, size: int) -> None:
+        if size <= len(self._ids):
+            return
+
+        capacity = max(len(self._ids), 1)
+        while capacity < size:
+            capacity *= 2
+
+        vectors = np.zeros((capacity, self.embedder.dimension), dtype=np.float32)
+        vectors[:len(self._lines)] = self._vectors[:len(self._lines)]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:len(self._lines)] = self._ids[:len(self._lines)]
+
+        self._vectors = vectors
+        self._ids = ids
+
+
+def create_embedder(name: str, dimension: int) -> Embedder:
+    if name == 'hashing':
+        return HashingEmbedder(dimension)
+
+    raise ValueError(f"Unknown embedder '{name}'")